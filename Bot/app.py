@@ -1,92 +1,131 @@
 import os
 import requests
-import json
-import base64
 import hmac
+import threading
 
-from flask import Flask, request, abort
-from github import Github, GithubIntegration
+from flask import Flask, Response, request, abort, jsonify
+from github import GithubException
+from github.Issue import Issue
+from github.Repository import Repository
 from apscheduler.schedulers.background import BackgroundScheduler
-from emailSender import send_email
+from emailSender import send_email, outbox
 from lingeringIssuesProcessor import process_lingering_issues
+from webhookQueue import WebhookQueue, QueueFullError
+from clients import github_access, config_cache, model_client, data_dir
+from lingeringIndex import LingeringIndex
+from modelClient import payload_texts
+from deliveryStore import DeliveryStore
+from metrics import WEBHOOK_QUEUE_DEPTH, count_avoided_requests, render as render_metrics
+from profiler import SamplingProfiler
 
 app = Flask(__name__)
 
-github_app_id = 821348
+# IDs of the webhook deliveries queued or being processed, and of those processed in the last delivery_ttl seconds, so
+# that deliveries sent again by GitHub are dropped; the processed ones are also stored in delivery_store_path (None to
+# only keep them in memory) to survive restarts
+delivery_ttl = 24 * 3600
+delivery_store_path = os.path.join(data_dir, "deliveries.sqlite")
+delivery_store = DeliveryStore(ttl=delivery_ttl, path=delivery_store_path)
 
-# Read the bot certificate
-with open("bot_key.pem", "r") as cert_file:
-    github_app_key = cert_file.read()
-
-# Create a GitHub integration instance
-git_integration = GithubIntegration(
-    github_app_id,
-    github_app_key,
-)
+# Index of the open issues of the repositories, so that each run only fetches the issues updated since the previous one
+lingering_index_path = os.path.join(data_dir, "lingering_index.sqlite")
+lingering_index = LingeringIndex(lingering_index_path)
 
 # Scheduling the processing of lingering issues
 scheduler = BackgroundScheduler()
 # Schedule the function process_lingering_issues to run every 1 day from the moment the bot is started
 lingering_check_frequency = 1
+# Number of repositories whose lingering issues are processed concurrently
+lingering_workers = 4
 scheduler.add_job(func=process_lingering_issues, trigger='interval', days=lingering_check_frequency,
-                  args=(git_integration, lingering_check_frequency))
-scheduler.start()
+                  args=(github_access, config_cache, lingering_index, lingering_check_frequency, lingering_workers))
+scheduler_pid = None
+
+
+"""
+Starts the scheduler in the process that serves the webhooks, so that the lingering issues jobs share its GitHub API
+budgets (webhook events hold their requests back, see githubAccess.py) and its metrics. Threads do not survive the fork
+of gunicorn --preload, so gunicorn calls it in the worker once it is forked (see gunicorn.conf.py), not at import.
+"""
+def start_background_jobs():
+    global scheduler_pid
+    if scheduler_pid == os.getpid():
+        return
+    scheduler_pid = os.getpid()
+    scheduler.start()
+
+
+# Delivery ID of the webhook event processed by the current worker thread
+current_event = threading.local()
+
+
+"""
+Runs a step of the current webhook event that writes to GitHub or sends an email, unless a previous attempt of the same
+delivery already did it: failing events are retried as a whole (see webhook_max_attempts), and a step such as posting a
+comment must not be repeated because a later step (e.g. the call to the ML model) failed.
+"""
+def run_once(step, action, *args):
+    delivery_id = getattr(current_event, "delivery_id", None)
+    if delivery_id is not None and delivery_store.step_done(delivery_id, step):
+        print(f"Skipping {step}, already done by a previous attempt of delivery {delivery_id}", flush=True)
+        return
+    action(*args)
+    if delivery_id is not None:
+        delivery_store.record_step(delivery_id, step)
+
+
+def send_email_once(issues, config, case, label=None):
+    run_once(f"email:{case}:{label}", send_email, issues, config, case, label)
+
+
+def create_comment_once(issue, step, body):
+    run_once(f"comment:{step}", issue.create_comment, body)
+
+
+# Labels are only added when the issue does not carry them yet, which saves a GitHub API call
+def add_label(issue, label):
+    if label in [existing.name for existing in issue.labels]:
+        print(f"Issue #{issue.number} is already labeled {label}", flush=True)
+        return
+    run_once(f"label:{label}", issue.add_to_labels, label)
 
 
 def label_issue(issue, config, label=None):
     if label is None:
         # Call the ML model API to get the label
-        url = config["endpoint"]
-        headers = {
-            "accept": "application/json",
-            "Content-Type": "application/json",
-        }
-        data = {}
-        if config["payload-type"] == "title":
-            data["text"] = issue.title
-        elif config["payload-type"] == "description":
-            if issue.body is not None:
-                data["text"] = issue.body
-            else:
-                print("Issue does not have a description, no label generated", flush=True)
-                return
-        elif config["payload-type"] == "merged":
-            data["text"] = issue.title + (" " + issue.body if issue.body is not None else "")
-        elif config["payload-type"] == "both":
-            label_title_and_desc(config, data, headers, issue, url)
+        if config["payload-type"] == "both":
+            label_title_and_desc(config, issue)
             return
-        result = requests.post(url, headers=headers, data=json.dumps(data)).json()
-        label_location = config["label-location"]
-        label = result[label_location]
+        texts = payload_texts(config, issue.title, issue.body)
+        if not texts:
+            print("Issue does not have a description, no label generated", flush=True)
+            return
+        label = model_client.label(config, texts[0][1])
         # Add the label to the issue
-        issue.add_to_labels(label)
+        add_label(issue, label)
         # Send email if emails for labels/all types of emails are enabled in config.json
         if config["send-emails"] is True and config["when-to-send"] in ["label", "all"]:
-            send_email([issue], config, 0, label)
+            send_email_once([issue], config, 0, label)
     else:
         # Simply add the label to the issue (for custom labels)
-        issue.add_to_labels(label)
+        add_label(issue, label)
         # Send email if emails for feature under development/all types of emails are enabled in config.json
         if config["send-emails"] is True and config["when-to-send"] in ["feature", "all"]:
-            send_email([issue], config, 2, label)
+            send_email_once([issue], config, 2, label)
 
 
-def label_title_and_desc(config, data, headers, issue, url):
-    data["text"] = issue.title
-    result = requests.post(url, headers=headers, data=json.dumps(data)).json()
-    label_location = config["label-location"]
-    title_label = result[label_location]
+def label_title_and_desc(config, issue):
+    # The title and the description are labeled with a single request to the model
+    if issue.body is not None:
+        title_label, description_label = model_client.label_many(config, [issue.title, issue.body])
+    else:
+        title_label, description_label = model_client.label(config, issue.title), None
     # Add the label generated for the issue title to the issue
-    issue.add_to_labels("title: " + title_label)
+    add_label(issue, "title: " + title_label)
 
-    description_label = None
-    if issue.body is not None:
-        data["text"] = issue.body
-        result = requests.post(url, headers=headers, data=json.dumps(data)).json()
-        label_location = config["label-location"]
-        description_label = result[label_location]
+    if description_label is not None:
         # Add the label generated for the issue description to the issue
-        issue.add_to_labels("description: " + description_label)
+        add_label(issue, "description: " + description_label)
     else:
         print("Issue does not have a description, no description label generated", flush=True)
 
@@ -98,23 +137,24 @@ def label_title_and_desc(config, data, headers, issue, url):
             description label is generated) or if the labels generated for both the title and the description of the 
             issue are identical
             """
-            send_email([issue], config, 0, title_label)
+            send_email_once([issue], config, 0, title_label)
         else:
             # Separate emails if the labels generated for the title and the description of the issue are different
-            send_email([issue], config, 0, "Title: " + title_label)
-            send_email([issue], config, 0, "Description: " + description_label)
+            send_email_once([issue], config, 0, "Title: " + title_label)
+            send_email_once([issue], config, 0, "Description: " + description_label)
 
 
-def handle_issue_comment_event(repo, payload, config):
+def handle_issue_comment_event(issue, payload, config):
     commenter = payload["comment"]["user"]["login"]
     if commenter == "issue-classification-bot[bot]":
         return "ok"
 
-    issue = repo.get_issue(number=payload["issue"]["number"])
-    comment = issue.get_comment(payload["comment"]["id"])
+    # The issue and the comment come with the payload, they are not fetched from GitHub
+    count_avoided_requests("issue_comment", "/repos/{owner}/{repo}/issues/{number}",
+                           "/repos/{owner}/{repo}/issues/comments/{id}")
 
     # Comment body will be a command like "/tdbot label", "/tdbot help", etc. So we need to parse it
-    command = comment.body.split(" ")
+    command = payload["comment"]["body"].split(" ")
     if command[0] == "/tdbot":
         if command[1] == "label":
             if len(command) == 2:
@@ -126,24 +166,26 @@ def handle_issue_comment_event(repo, payload, config):
         elif command[1] == "help":
             with open("help_message.txt", "r") as f:
                 help_message = f.read()
-            issue.create_comment(help_message)
+            create_comment_once(issue, "help", help_message)
         else:
-            issue.create_comment(
+            create_comment_once(
+                issue, "unknown-command",
                 "I don't understand your command. Please try again or comment \"/tdbot help\" to learn about the available commands."
             )
 
     return "ok"
 
 
-def handle_issue_creation_event(repo, payload, config):
+def handle_issue_creation_event(issue, payload, config):
     # Check if the issue is newly created
     if payload["action"] != "opened":
         return "ok"
 
-    issue = repo.get_issue(number=payload["issue"]["number"])
+    count_avoided_requests("issues", "/repos/{owner}/{repo}/issues/{number}")
     # Check if initial messages for issues is enabled in config.json
     if config["initial-message"] is True:
-        issue.create_comment(
+        create_comment_once(
+            issue, "initial-message",
             ":robot: **Issue Classification Bot** is active on this repository.\n\n"
             'Learn what commands you can use in issues by commenting "/tdbot help"\n\n'
             'Alternatively, refer to the [documentation](https://github.com/oscardef/issue-classification-bot-2/blob/email-sender/README.md) for further information about the bot.'
@@ -153,11 +195,82 @@ def handle_issue_creation_event(repo, payload, config):
         label_issue(issue, config)
     # Send email if emails for feature under development/all types of emails are enabled in config.json
     if config["send-emails"] is True and config["when-to-send"] in ["feature", "all"]:
-        send_email([issue], config, 2)
+        send_email_once([issue], config, 2)
 
     return "ok"
 
 
+"""
+Only errors that may go away on their own (network errors, GitHub server errors and rate limiting) are worth retrying.
+"""
+def is_retryable(error):
+    if isinstance(error, GithubException):
+        return error.status >= 500 or error.status in [403, 429]
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, ConnectionError,
+                              TimeoutError))
+
+
+def process_event(payload_type, payload, delivery_id=None):
+    current_event.delivery_id = delivery_id
+    try:
+        return process_payload(payload_type, payload)
+    finally:
+        current_event.delivery_id = None
+
+
+def process_payload(payload_type, payload):
+    owner = payload["repository"]["owner"]["login"]
+    repo_name = payload["repository"]["name"]
+
+    installation_id = github_access.installation_id(owner, repo_name)
+    # Webhook events have priority over the background jobs of the installation for its GitHub API rate limit
+    with github_access.interactive(installation_id):
+        # Get a git connection as our bot
+        git_connection = github_access.client(installation_id)
+
+        """
+        The repository and the issue are built from the payload instead of being fetched from GitHub: the payload
+        carries the issue's title, body, author, labels and URLs, and the API URLs are all that is needed to write to
+        them (labels, comments). Their attributes that are not in the payload are None, they are never fetched.
+        """
+        repo = git_connection.create_from_raw_data(Repository, payload["repository"])
+        issue = git_connection.create_from_raw_data(Issue, payload["issue"])
+        count_avoided_requests(payload_type, "/repos/{owner}/{repo}")
+        # If repo has config.json file in the Bot directory, use it. Otherwise, use the config.json file locally in the
+        # bot
+        config = config_cache.get(repo)
+
+        # Check if the event is a GitHub issue comment creation or issue creation event
+        if payload_type == "issue_comment":
+            return handle_issue_comment_event(issue, payload, config)
+        elif payload_type == "issues":
+            return handle_issue_creation_event(issue, payload, config)
+
+
+"""
+Webhook events are processed in the background by a pool of workers, events of the same repository in the order they 
+were received. Failing events are retried with exponential backoff (webhook_retry_backoff, doubled at each attempt);
+the comments, labels and emails that a previous attempt already did are skipped (see run_once).
+"""
+webhook_workers = 4
+webhook_queue_size = 1000
+webhook_max_attempts = 3
+webhook_retry_backoff = 2
+webhook_queue = WebhookQueue(process_event, workers=webhook_workers, max_size=webhook_queue_size,
+                             max_attempts=webhook_max_attempts, retry_backoff=webhook_retry_backoff,
+                             is_retryable=is_retryable, on_success=delivery_store.complete,
+                             on_failure=delivery_store.release)
+WEBHOOK_QUEUE_DEPTH.set_function(lambda: webhook_queue.stats()["queue_depth"])
+
+"""
+The sampling profiler can be switched on at runtime through the /debug/profile endpoints, which are only available when
+the BOT_PROFILER environment variable is set to "true". A profile lasts at most max_profile_seconds seconds.
+"""
+profiler_enabled = os.getenv("BOT_PROFILER", "false").lower() == "true"
+max_profile_seconds = 60
+sampling_profiler = SamplingProfiler()
+
+
 @app.route("/webhook", methods=["POST"])
 def bot():
     # Validate that the request is from GitHub
@@ -183,36 +296,84 @@ def bot():
 
     # Check if the event is a GitHub App install/uninstall event
     if payload_type in ["installation", "installation_repositories"]:
+        # Forget the cached installation ID and token, they may no longer be valid for the affected repositories
+        github_access.invalidate_installation(payload["installation"]["id"])
         return "ok"
 
-    owner = payload["repository"]["owner"]["login"]
-    repo_name = payload["repository"]["name"]
+    # A push may change the config file of the repository
+    if payload_type == "push":
+        config_cache.handle_push(payload)
+        return "ok"
 
-    # Get a git connection as our bot
-    git_connection = Github(
-        login_or_token=git_integration.get_access_token(
-            git_integration.get_installation(owner, repo_name).id
-        ).token
-    )
+    # Only issue comment creation and issue creation events are processed
+    if payload_type not in ["issue_comment", "issues"]:
+        return "ok"
+
+    # A delivery sent again by GitHub (e.g. after a timeout) is dropped, it has already been processed or is queued
+    delivery_id = request.headers.get("X-GitHub-Delivery")
+    if delivery_id is not None and not delivery_store.claim(delivery_id):
+        print(f"Dropping duplicate delivery {delivery_id}", flush=True)
+        return "ok"
 
-    repo = git_connection.get_repo(f"{owner}/{repo_name}")
-    # If repo has config.json file in the Bot directory, use it. Otherwise, use the config.json file locally in the bot
+    # Reply to GitHub right away, the event is processed in the background. The delivery is recorded as done once its
+    # processing succeeded; deliveries that could not be queued or whose processing failed are forgotten, so that GitHub
+    # can deliver them again
+    try:
+        webhook_queue.submit(payload["repository"]["full_name"], payload_type, payload, delivery_id,
+                             key=delivery_id)
+    except QueueFullError as e:
+        print(e, flush=True)
+        delivery_store.release(delivery_id)
+        abort(503)
+
+    return "accepted", 202
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify({"webhook_queue": webhook_queue.stats(), "config_cache": config_cache.stats(),
+                    "model_client": model_client.stats(), "email_outbox": outbox.stats(),
+                    "github_rate_limits": github_access.stats(),
+                    "deliveries": delivery_store.stats()})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    content, content_type = render_metrics()
+    return Response(content, content_type=content_type)
+
+
+@app.route("/debug/profile/start", methods=["POST"])
+def start_profile():
+    if not profiler_enabled:
+        abort(404)
+    if not sampling_profiler.start():
+        return "A profile is already being captured", 409
+    return "started"
+
+
+@app.route("/debug/profile/stop", methods=["POST"])
+def stop_profile():
+    if not profiler_enabled:
+        abort(404)
+    if not sampling_profiler.running:
+        return "No profile is being captured", 409
+    return Response(sampling_profiler.stop(), content_type="text/plain")
+
+
+@app.route("/debug/profile", methods=["GET"])
+def profile():
+    if not profiler_enabled:
+        abort(404)
+    seconds = request.args.get("seconds", 10, type=float)
+    if not 0 < seconds <= max_profile_seconds:
+        return f"The duration of a profile must be between 0 and {max_profile_seconds} seconds", 400
     try:
-        config_file = repo.get_contents("Bot/config.json")
-        print("Using config file from the repository", flush=True)
-        # Decode the file
-        config = json.loads(base64.b64decode(config_file.content).decode("utf-8"))
-    except:
-        with open("config.json", "r") as f:
-            config = json.load(f)
-            print("Using config file from the local Bot directory as it is not present in the repository", flush=True)
-
-    # Check if the event is a GitHub issue comment creation or issue creation event
-    if payload_type == "issue_comment":
-        return handle_issue_comment_event(repo, payload, config)
-    elif payload_type == "issues":
-        return handle_issue_creation_event(repo, payload, config)
+        return Response(sampling_profiler.profile(seconds), content_type="text/plain")
+    except RuntimeError as e:
+        return str(e), 409
 
 
 if __name__ == "__main__":
+    start_background_jobs()
     app.run(host="0.0.0.0", debug=True, port=5001)
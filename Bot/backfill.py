@@ -0,0 +1,196 @@
+import argparse
+import csv
+import json
+import os
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from github import GithubException
+from modelClient import ModelClientError, payload_texts
+
+"""
+* Backfill of the labels of the existing issues of a repository, e.g. when the bot is installed on a repository that
+  already has thousands of issues:
+      python backfill.py owner/repository [--dry-run] [--state open|closed|all]
+* The issues are listed page by page, oldest first, and labeled by the ML model in batches of at most batch_size issues
+  and batch_bytes bytes of text (one request to the batch endpoint of the model backend per batch, below its request
+  size limit), using the "payload-type" and "endpoint" fields of the config.json of the repository, like the
+  "/tdbot label" command. Pull requests are skipped and no emails are sent.
+* When the model fails on a batch, its issues are labeled one at a time, and the issues that still fail are reported as
+  "failed" instead of stopping the backfill.
+* The labels of a batch are added with workers concurrent requests. Each of them is a background job of the
+  installation, so the backfill leaves enough of the GitHub API rate limit for webhook events (see githubAccess.py).
+* After each batch, the number of the last labeled issue is saved in a checkpoint file, so an interrupted backfill
+  resumes after it. The issues before the checkpoint are still listed, but neither labeled nor written to.
+* Every issue gets a line in a CSV report (issue number, title, labels, action). In dry-run mode, nothing is written to
+  GitHub and the report shows the labels that would be added; dry runs have their own checkpoint and report.
+"""
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self._path = path
+        self.state = {"last_number": 0, "labeled": 0, "already_labeled": 0, "no_text": 0, "failed": 0}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.state.update(json.load(f))
+
+    @property
+    def last_number(self):
+        return self.state["last_number"]
+
+    def save(self, last_number, actions):
+        self.state["last_number"] = last_number
+        for action in actions:
+            self.state[action] += 1
+        # Replacing the file at once, an interruption never leaves a partially written checkpoint
+        temporary_path = self._path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(temporary_path, self._path)
+
+
+"""
+Adds the labels of an issue that it does not have yet, returns the action written to the report.
+"""
+def apply_labels(issue, labels, dry_run):
+    existing = {label.name for label in issue.labels}
+    missing = [label for label in labels if label not in existing]
+    if not missing:
+        return "already_labeled"
+    if not dry_run:
+        issue.add_to_labels(*missing)
+    return "labeled"
+
+
+# Errors of the model backend for some texts (e.g. a text over its request size limit), or of the connection to it
+MODEL_ERRORS = (ModelClientError, requests.exceptions.RequestException)
+
+
+def text_size(config, issue):
+    return sum(len(text.encode("utf-8", "surrogatepass")) for _, text in payload_texts(config, issue.title, issue.body))
+
+
+def model_labels(model_client, config, issues):
+    texts = []
+    owners = []
+    for issue in issues:
+        for prefix, text in payload_texts(config, issue.title, issue.body):
+            texts.append(text)
+            owners.append((issue.number, prefix))
+    labels = model_client.label_many(config, texts) if texts else []
+
+    issue_labels = {issue.number: [] for issue in issues}
+    for (number, prefix), label in zip(owners, labels):
+        issue_labels[number].append(prefix + label)
+    return issue_labels
+
+
+"""
+Labels of the issues of a batch, None for the issues the model failed on. A failing batch is labeled again one issue at
+a time, so that a single issue (e.g. with a huge body) does not fail the others.
+"""
+def batch_labels(model_client, config, issues):
+    try:
+        return model_labels(model_client, config, issues)
+    except MODEL_ERRORS as e:
+        if len(issues) == 1:
+            print(f"Labeling issue #{issues[0].number} with the model failed: {e}", flush=True)
+            return {issues[0].number: None}
+        print(f"Labeling a batch of {len(issues)} issues with the model failed: {e}, labeling them one at a time",
+              flush=True)
+    issue_labels = {}
+    for issue in issues:
+        issue_labels.update(batch_labels(model_client, config, [issue]))
+    return issue_labels
+
+
+def label_batch(github_access, installation_id, model_client, config, issues, dry_run, executor):
+    issue_labels = batch_labels(model_client, config, issues)
+
+    def apply(issue):
+        if issue_labels[issue.number] is None:
+            return "failed"
+        if not issue_labels[issue.number]:
+            return "no_text"
+        try:
+            with github_access.background(installation_id):
+                return apply_labels(issue, issue_labels[issue.number], dry_run)
+        except GithubException as e:
+            print(f"Labeling issue #{issue.number} failed: {e}", flush=True)
+            return "failed"
+
+    actions = list(executor.map(apply, issues))
+    return [(issue, issue_labels[issue.number] or [], action) for issue, action in zip(issues, actions)]
+
+
+def backfill_repository(github_access, config_cache, model_client, full_name, data_dir, state="open", batch_size=50,
+                        batch_bytes=512 * 1024, workers=4, dry_run=False):
+    owner, repo_name = full_name.split("/")
+    installation_id = github_access.installation_id(owner, repo_name)
+    repo = github_access.client(installation_id).get_repo(full_name)
+    config = config_cache.get(repo)
+
+    directory = os.path.join(data_dir, "backfill")
+    os.makedirs(directory, exist_ok=True)
+    name = f"{owner}__{repo_name}" + (".dry-run" if dry_run else "")
+    checkpoint = Checkpoint(os.path.join(directory, name + ".checkpoint.json"))
+    report_path = os.path.join(directory, name + ".csv")
+    if checkpoint.last_number:
+        print(f"Resuming the backfill of {full_name} after issue #{checkpoint.last_number}", flush=True)
+
+    def flush(batch):
+        results = label_batch(github_access, installation_id, model_client, config, batch, dry_run, executor)
+        with open(report_path, "a", newline="") as f:
+            writer = csv.writer(f)
+            for issue, labels, action in results:
+                writer.writerow([issue.number, issue.title, "; ".join(labels), action])
+        checkpoint.save(batch[-1].number, [action for _, _, action in results])
+        print(f"Backfill of {full_name}: up to issue #{batch[-1].number}, {checkpoint.state}", flush=True)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill") as executor, \
+            github_access.background_requests():
+        batch = []
+        size = 0
+        # Issue numbers increase with the creation date, so the issues up to the checkpoint come first
+        for issue in repo.get_issues(state=state, sort="created", direction="asc"):
+            if issue.number <= checkpoint.last_number or issue.pull_request is not None:
+                continue
+            issue_size = text_size(config, issue)
+            if batch and size + issue_size > batch_bytes:
+                flush(batch)
+                batch = []
+                size = 0
+            batch.append(issue)
+            size += issue_size
+            if len(batch) == batch_size:
+                flush(batch)
+                batch = []
+                size = 0
+        if batch:
+            flush(batch)
+
+    print(f"Backfill of {full_name} finished: {checkpoint.state}, report written to {report_path}", flush=True)
+    return checkpoint.state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Label the existing issues of a repository")
+    parser.add_argument("repository", help="owner/repository")
+    parser.add_argument("--state", choices=["open", "closed", "all"], default="open")
+    parser.add_argument("--batch-size", type=int, default=50, help="issues per request to the model backend")
+    parser.add_argument("--batch-bytes", type=int, default=512 * 1024,
+                        help="bytes of text per request to the model backend (below its max_request_bytes)")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent label requests to GitHub")
+    parser.add_argument("--dry-run", action="store_true", help="only write the report, do not add labels")
+    args = parser.parse_args()
+
+    # The bot's GitHub App access, config cache and model client, without the background work of the web app
+    from clients import github_access, config_cache, model_client, data_dir
+    backfill_repository(github_access, config_cache, model_client, args.repository, data_dir, state=args.state,
+                        batch_size=args.batch_size, batch_bytes=args.batch_bytes, workers=args.workers,
+                        dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
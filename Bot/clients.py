@@ -0,0 +1,56 @@
+import os
+
+from github import GithubIntegration
+from githubAccess import GitHubAccess
+from configCache import ConfigCache, load_default_config
+from labelCache import LabelCache
+from metrics import instrument_github
+from modelClient import ModelClient
+
+"""
+* GitHub App access, config cache and model client of the bot, shared by the web app (app.py) and the command line tools
+  (backfill.py).
+* Importing this module starts nothing in the background (no scheduler, webhook workers or email outbox), which is left
+  to app.py.
+"""
+
+github_app_id = 821348
+
+# Time the GitHub API requests of every client created below (exposed at /metrics)
+instrument_github()
+
+# Read the bot certificate
+with open("bot_key.pem", "r") as cert_file:
+    github_app_key = cert_file.read()
+
+# Create a GitHub integration instance
+git_integration = GithubIntegration(
+    github_app_id,
+    github_app_key,
+)
+
+# Installation IDs, access tokens and GitHub clients are cached and shared by webhook events and scheduled jobs
+github_access = GitHubAccess(git_integration)
+
+# Config files of the repositories are cached for config_ttl seconds, then revalidated with conditional requests; a
+# repository without a config file is checked again after missing_config_ttl seconds, or when a push adds the file
+config_ttl = 300
+missing_config_ttl = 3600
+config_cache = ConfigCache(load_default_config(), config_ttl=config_ttl, missing_config_ttl=missing_config_ttl)
+
+# Persistent state of the bot (labels, webhook deliveries, the lingering issues index, the checkpoints and reports of
+# backfill.py)
+data_dir = os.getenv("BOT_DATA_DIR", "data")
+
+# Labels returned by the ML model endpoints are reused for label_cache_ttl seconds when the same text is labeled again
+# with the same config; they are also stored in label_cache_path (None to only keep them in memory) to survive restarts
+label_cache_ttl = 24 * 3600
+label_cache_size = 10000
+label_cache_path = os.path.join(data_dir, "labels.sqlite")
+
+# Requests to the ML model endpoints share a connection pool, time out after model_timeout seconds and are retried
+model_timeout = 30
+model_max_retries = 3
+model_client = ModelClient(read_timeout=model_timeout, max_retries=model_max_retries,
+                           label_cache=LabelCache(ttl=label_cache_ttl, max_entries=label_cache_size,
+                                                  path=label_cache_path))
@@ -0,0 +1,132 @@
+import base64
+import json
+import threading
+import time
+
+from github import GithubException
+
+"""
+* Cache of the Bot/config.json file of each repository, shared by webhook events and the lingering issues job.
+* A cached config is used as-is for config_ttl seconds. After that it is revalidated with a conditional request
+  (If-None-Match with the ETag of the file), which GitHub answers with 304 Not Modified when the file did not change, and
+  such responses do not count against the rate limit.
+* Repositories without a Bot/config.json file (or with an unreadable one) use the local config.json file, which is
+  parsed and validated only once.
+* A missing file cannot be revalidated with a conditional request, so it is only looked for again after
+  missing_config_ttl seconds, or as soon as a push adds it (see below). An unreadable file is revalidated like a valid
+  one, with its ETag.
+* A push to the default branch of a repository that touches Bot/config.json invalidates its cached config.
+"""
+
+CONFIG_PATH = "Bot/config.json"
+REQUIRED_KEYS = ["payload-type", "endpoint", "label-location", "auto-label", "initial-message", "send-emails",
+                 "when-to-send"]
+# GitHub lists at most 20 commits in a push webhook, the files touched by the other commits are unknown
+MAX_PUSH_COMMITS = 20
+
+
+class InvalidConfigError(Exception):
+    pass
+
+
+def validate_config(config):
+    missing = [key for key in REQUIRED_KEYS if key not in config]
+    if missing:
+        raise InvalidConfigError(f"config.json is missing the field(s): {', '.join(missing)}")
+    if config["send-emails"] is True and "email-info" not in config:
+        raise InvalidConfigError("config.json has \"send-emails\" enabled but no \"email-info\"")
+    return config
+
+
+def load_default_config(path="config.json"):
+    with open(path, "r") as f:
+        return validate_config(json.load(f))
+
+
+class ConfigCache:
+    def __init__(self, default_config, config_ttl=300, missing_config_ttl=3600):
+        self.default_config = default_config
+        self._config_ttl = config_ttl
+        self._missing_config_ttl = missing_config_ttl
+        self._lock = threading.Lock()
+        # Repository full name -> (ContentFile or None, parsed config, time of the last check, seconds it is valid for)
+        self._entries = {}
+        self._stats = {"hits": 0, "not_modified": 0, "fetched": 0, "defaults": 0, "missing": 0, "invalidated": 0}
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def get(self, repo):
+        key = repo.full_name.lower()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[2] < entry[3]:
+            self._count("hits")
+            return entry[1]
+
+        config_file, config = (entry[0], entry[1]) if entry is not None else (None, None)
+        ttl = self._config_ttl
+        try:
+            if config_file is not None:
+                # Conditional request: only downloads the file again if its ETag changed
+                if config_file.update():
+                    config = self._parse(repo, config_file)
+                    self._count("fetched")
+                else:
+                    self._count("not_modified")
+            else:
+                config_file = repo.get_contents(CONFIG_PATH)
+                config = self._parse(repo, config_file)
+                self._count("fetched")
+        except GithubException as e:
+            if e.status != 404 and config is not None:
+                # GitHub is unavailable, keep using the last known config of the repository
+                print(f"Could not revalidate the config file of {repo.full_name}: {e}", flush=True)
+                return config
+            if e.status == 404:
+                self._count("missing")
+                ttl = self._missing_config_ttl
+            config_file, config = None, None
+        except (InvalidConfigError, ValueError) as e:
+            # The file is kept, so that it is revalidated with a conditional request until it is fixed
+            print(f"The config file of {repo.full_name} is not valid: {e}", flush=True)
+            config = None
+
+        if config is None:
+            print("Using config file from the local Bot directory as it is not present in the repository", flush=True)
+            self._count("defaults")
+            config = self.default_config
+        with self._lock:
+            self._entries[key] = (config_file, config, time.monotonic(), ttl)
+        return config
+
+    @staticmethod
+    def _parse(repo, config_file):
+        print(f"Using config file from the {repo.full_name} repository", flush=True)
+        return validate_config(json.loads(base64.b64decode(config_file.content).decode("utf-8")))
+
+    def invalidate(self, full_name):
+        with self._lock:
+            if self._entries.pop(full_name.lower(), None) is not None:
+                self._stats["invalidated"] += 1
+
+    """
+    Invalidates the cached config of the repository of a push webhook event if the push changed Bot/config.json on the
+    default branch, the branch the config file is read from.
+    """
+    def handle_push(self, payload):
+        repository = payload["repository"]
+        if payload.get("ref") != f"refs/heads/{repository['default_branch']}":
+            return
+        commits = payload.get("commits", [])
+        touched = len(commits) >= MAX_PUSH_COMMITS or any(
+            CONFIG_PATH in commit.get(change, [])
+            for commit in commits for change in ["added", "modified", "removed"]
+        )
+        if touched:
+            self.invalidate(repository["full_name"])
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "repositories": len(self._entries)}
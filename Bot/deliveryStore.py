@@ -0,0 +1,165 @@
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+"""
+* Store of the IDs of the webhook deliveries processed by the bot (X-GitHub-Delivery header), so that a delivery that
+  GitHub sends again (e.g. after a timeout) is dropped before any GitHub API or model call, instead of labeling the issue
+  and sending the emails once more.
+* A delivery is claimed when it is received and only kept in memory while it is queued or being processed, so that a
+  second copy received meanwhile is dropped too. It is recorded as done once its processing succeeded; a delivery that
+  was lost (e.g. queued when the bot restarted or crashed) is therefore accepted when GitHub delivers it again.
+* The steps of a delivery that write to GitHub or send emails (comments, labels, emails) are recorded as they are done,
+  so that a retry of the delivery after a transient error, or a redelivery after it failed, skips them instead of
+  doing them again. They are forgotten once the delivery is done.
+* The IDs of the done deliveries are kept in memory for ttl seconds (at most max_entries of them, the oldest are evicted
+  first). With a path, they are also stored in a sqlite database, so that deliveries processed before a restart of the
+  bot are still recognized.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    delivery_id TEXT PRIMARY KEY,
+    received_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deliveries_received_at ON deliveries (received_at);
+CREATE TABLE IF NOT EXISTS delivery_steps (
+    delivery_id TEXT NOT NULL,
+    step TEXT NOT NULL,
+    done_at REAL NOT NULL,
+    PRIMARY KEY (delivery_id, step)
+);
+CREATE INDEX IF NOT EXISTS delivery_steps_done_at ON delivery_steps (done_at);
+"""
+
+# Expired deliveries are deleted from the database at most once per this many seconds
+EVICTION_INTERVAL = 60
+
+
+class DeliveryStore:
+    def __init__(self, ttl=86400, path=None, max_entries=100000):
+        self._ttl = ttl
+        self._path = path
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._deliveries = OrderedDict()
+        self._in_flight = set()
+        # Delivery ID -> steps done, for the deliveries that are not done yet
+        self._steps = OrderedDict()
+        self._last_eviction = 0
+        self._stats = {"accepted": 0, "duplicates": 0, "completed": 0}
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as connection:
+                connection.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self._path, timeout=30)
+
+    def _evict(self, now):
+        while self._deliveries:
+            delivery_id, received_at = next(iter(self._deliveries.items()))
+            if now - received_at < self._ttl and len(self._deliveries) < self._max_entries:
+                break
+            self._deliveries.popitem(last=False)
+
+    """
+    Marks the delivery as in flight and returns True, or returns False if it is already in flight or was processed in
+    the last ttl seconds.
+    """
+    def claim(self, delivery_id):
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            if delivery_id in self._deliveries or delivery_id in self._in_flight:
+                self._stats["duplicates"] += 1
+                return False
+            if self._path is not None and self._done_persistent(delivery_id, now):
+                self._deliveries[delivery_id] = now
+                self._stats["duplicates"] += 1
+                return False
+            self._in_flight.add(delivery_id)
+            self._stats["accepted"] += 1
+            return True
+
+    def _done_persistent(self, delivery_id, now):
+        with self._connect() as connection:
+            row = connection.execute("SELECT received_at FROM deliveries WHERE delivery_id = ?",
+                                     (delivery_id,)).fetchone()
+            return row is not None and now - row[0] < self._ttl
+
+    """
+    Records a claimed delivery as processed, so that it is dropped when GitHub delivers it again. Events without a
+    delivery ID are ignored.
+    """
+    def complete(self, delivery_id):
+        if delivery_id is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._in_flight.discard(delivery_id)
+            self._steps.pop(delivery_id, None)
+            self._deliveries[delivery_id] = now
+            self._stats["completed"] += 1
+            if self._path is not None:
+                with self._connect() as connection:
+                    if now - self._last_eviction >= EVICTION_INTERVAL:
+                        connection.execute("DELETE FROM deliveries WHERE received_at < ?", (now - self._ttl,))
+                        connection.execute("DELETE FROM delivery_steps WHERE done_at < ?", (now - self._ttl,))
+                        self._last_eviction = now
+                    connection.execute("INSERT OR REPLACE INTO deliveries VALUES (?, ?)", (delivery_id, now))
+                    connection.execute("DELETE FROM delivery_steps WHERE delivery_id = ?", (delivery_id,))
+
+    """
+    Whether a step of the delivery (e.g. "label:SATD") was done by a previous attempt of it.
+    """
+    def step_done(self, delivery_id, step):
+        with self._lock:
+            steps = self._steps.get(delivery_id)
+            if steps is None and self._path is not None:
+                with self._connect() as connection:
+                    steps = {row[0] for row in connection.execute(
+                        "SELECT step FROM delivery_steps WHERE delivery_id = ?", (delivery_id,))}
+                self._remember_steps(delivery_id, steps)
+            return step in (steps or ())
+
+    def record_step(self, delivery_id, step):
+        now = time.time()
+        with self._lock:
+            steps = self._steps.get(delivery_id, set())
+            steps.add(step)
+            self._remember_steps(delivery_id, steps)
+            if self._path is not None:
+                with self._connect() as connection:
+                    connection.execute("INSERT OR REPLACE INTO delivery_steps VALUES (?, ?, ?)",
+                                       (delivery_id, step, now))
+
+    def _remember_steps(self, delivery_id, steps):
+        self._steps[delivery_id] = steps
+        self._steps.move_to_end(delivery_id)
+        while len(self._steps) > self._max_entries:
+            self._steps.popitem(last=False)
+
+    """
+    Forgets the delivery, so that GitHub can deliver it again (e.g. when it could not be queued or its processing
+    failed). The steps it already did are kept, so that the redelivery skips them. Events without a delivery ID are
+    ignored.
+    """
+    def release(self, delivery_id):
+        if delivery_id is None:
+            return
+        with self._lock:
+            self._in_flight.discard(delivery_id)
+            self._deliveries.pop(delivery_id, None)
+            if self._path is not None:
+                with self._connect() as connection:
+                    connection.execute("DELETE FROM deliveries WHERE delivery_id = ?", (delivery_id,))
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "tracked": len(self._deliveries), "in_flight": len(self._in_flight)}
@@ -0,0 +1,165 @@
+import os
+import smtplib
+import threading
+import time
+
+from collections import deque
+from email.mime.text import MIMEText
+from metrics import EMAIL_SEND_SECONDS
+
+"""
+* Outbox for the emails of the bot: emails are queued by the caller and sent by a background thread, so that labeling an
+  issue never waits for the mail server.
+* The background thread keeps one authenticated SMTP connection open and reuses it for all emails, instead of doing a
+  TLS handshake and a login for every email. The connection is closed after idle_timeout seconds without emails, and
+  re-established (and the email sent again) when the server dropped it.
+* In digest mode (digest_window > 0 seconds), the emails to the same recipient are held for digest_window seconds after
+  the first one and then sent together as a single email.
+"""
+
+# Errors after which the connection is re-established and the email sent once more
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+IDLE_CHECK_INTERVAL = 30
+
+
+class SMTPConnection:
+    def __init__(self, server, port, address, password, use_ssl=True, timeout=30, idle_timeout=60):
+        self._server = server
+        self._port = port
+        self._address = address
+        self._password = password
+        self._use_ssl = use_ssl
+        self._timeout = timeout
+        self._idle_timeout = idle_timeout
+        self._smtp = None
+        self._last_used = 0
+        self.connects = 0
+
+    def _connect(self):
+        if self._use_ssl:
+            # Establish the SMTP connection to specified server over a secure SSL connection
+            smtp = smtplib.SMTP_SSL(self._server, self._port, timeout=self._timeout)
+        else:
+            smtp = smtplib.SMTP(self._server, self._port, timeout=self._timeout)
+        smtp.ehlo()
+        # Log in on the SMTP server using the specified bot email address and bot email password
+        if self._password and smtp.has_extn("auth"):
+            smtp.login(self._address, self._password)
+        self._smtp = smtp
+        self.connects += 1
+
+    def send(self, recipients, message):
+        for attempt in range(2):
+            if self._smtp is None:
+                self._connect()
+            try:
+                self._smtp.sendmail(self._address, recipients, message)
+                self._last_used = time.monotonic()
+                return
+            except CONNECTION_ERRORS:
+                self._smtp = None
+                if attempt == 1:
+                    raise
+
+    def close_if_idle(self):
+        if self._smtp is not None and time.monotonic() - self._last_used >= self._idle_timeout:
+            self.close()
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+class Outbox:
+    def __init__(self, connection, sender_name, digest_window=0, max_size=1000):
+        self._connection = connection
+        self._sender_name = sender_name
+        self._digest_window = digest_window
+        self._max_size = max_size
+        self._condition = threading.Condition()
+        self._queue = deque()
+        # Recipient -> (time when the digest is sent, list of (subject, body))
+        self._digests = {}
+        self._pid = None
+        self._stats = {"queued": 0, "dropped": 0, "sent": 0, "failed": 0, "digests": 0}
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._work, name="email-outbox", daemon=True).start()
+
+    def submit(self, recipients, subject, body):
+        with self._condition:
+            self._ensure_started()
+            if self._digest_window > 0:
+                for recipient in recipients:
+                    _, messages = self._digests.setdefault(
+                        recipient, (time.monotonic() + self._digest_window, []))
+                    messages.append((subject, body))
+            elif len(self._queue) >= self._max_size:
+                self._stats["dropped"] += 1
+                print(f"Email outbox is full ({self._max_size} emails), email '{subject}' dropped", flush=True)
+                return
+            else:
+                self._queue.append((recipients, subject, body))
+            self._stats["queued"] += 1
+            self._condition.notify()
+
+    def _next(self):
+        with self._condition:
+            while True:
+                if self._queue:
+                    return self._queue.popleft()
+                now = time.monotonic()
+                due = [recipient for recipient, (deadline, _) in self._digests.items() if deadline <= now]
+                if due:
+                    recipient = due[0]
+                    _, messages = self._digests.pop(recipient)
+                    return self._digest(recipient, messages)
+                deadlines = [deadline for deadline, _ in self._digests.values()]
+                # Also wake up now and then so that an idle connection gets closed
+                timeout = min(deadlines + [now + IDLE_CHECK_INTERVAL]) - now
+                if not self._condition.wait(timeout):
+                    self._connection.close_if_idle()
+
+    def _digest(self, recipient, messages):
+        if len(messages) == 1:
+            subject, body = messages[0]
+            return [recipient], subject, body
+        self._stats["digests"] += 1
+        digest_subject = f"{len(messages)} notifications from the {self._sender_name}"
+        digest_body = "\n\n".join(f"{subject}\n{'-' * len(subject)}\n{body}" for subject, body in messages)
+        return [recipient], digest_subject, digest_body
+
+    def _work(self):
+        while True:
+            recipients, subject, body = self._next()
+            # MIMEText used to create the email object
+            email = MIMEText(body)
+            email['From'] = self._sender_name
+            email['To'] = ', '.join(recipients)
+            email['Subject'] = subject
+            start = time.perf_counter()
+            try:
+                self._connection.send(recipients, email.as_string())
+                print("Email sent successfully!", flush=True)
+                stat = "sent"
+            except smtplib.SMTPException as error:
+                print(f"SMTP mail sending error: {error}", flush=True)
+                stat = "failed"
+            except Exception as error:
+                print(f"Mail sending error: {error}", flush=True)
+                stat = "failed"
+            EMAIL_SEND_SECONDS.labels(stat).observe(time.perf_counter() - start)
+            with self._condition:
+                self._stats[stat] += 1
+
+    def stats(self):
+        with self._condition:
+            return {**self._stats, "queue_depth": len(self._queue), "pending_digests": len(self._digests),
+                    "connections": self._connection.connects}
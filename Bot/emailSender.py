@@ -1,6 +1,11 @@
-import smtplib
+import io
+import os
+import re
+import string
 
-from email.mime.text import MIMEText
+from datetime import datetime
+from functools import lru_cache
+from emailOutbox import Outbox, SMTPConnection
 
 """
 Read the bot email info from a "bot_email.secret" file structured as follows:
@@ -14,30 +19,68 @@ bot_email_address = lines[0]
 bot_email_password = lines[1]
 # This is the name that we want to be displayed as the sender to the recipients, instead of the actual bot email address
 bot_name = 'Issue Classification Bot'
-email_server = 'smtp.gmail.com'
-email_server_port = 465
+# The mail server can be replaced, e.g. by a local stand-in SMTP server without SSL for testing
+email_server = os.getenv("BOT_SMTP_SERVER", 'smtp.gmail.com')
+email_server_port = int(os.getenv("BOT_SMTP_PORT", 465))
+email_server_ssl = os.getenv("BOT_SMTP_SSL", "true").lower() == "true"
+# Seconds during which the emails to the same recipient are collected into a single digest email (0 to disable)
+email_digest_window = int(os.getenv("BOT_EMAIL_DIGEST_WINDOW", 0))
+
+# Emails are sent in the background over a single reused SMTP connection
+outbox = Outbox(SMTPConnection(email_server, email_server_port, bot_email_address, bot_email_password,
+                               use_ssl=email_server_ssl),
+                bot_name, digest_window=email_digest_window)
+
+
+"""
+* Email templates are compiled once (per template string of a config) into a render plan: the literal parts of the 
+  template, and in between, the placeholders to replace. Rendering an issue then joins the parts in a single pass.
+* Only the fields used by a template are computed, from the issue's raw GitHub data (or the lingering issues index), so 
+  that rendering never fetches anything from GitHub (e.g. the repository of an issue just to obtain its name).
+* Also handling the edge case where some issues might not have a description (body), but the template string specified
+  in the Bot/config.json uses the /issue_description placeholder, in which case the placeholder will be replaced with 
+  the empty string in the generated email body, to avoid any errors.
+"""
+def format_date(value):
+    # Same format as the datetime attributes of PyGithub objects, e.g. 2024-05-01 12:00:00+00:00
+    return str(datetime.fromisoformat(value.replace("Z", "+00:00")))
+
+
+issue_fields = {
+    '/issue_number': lambda raw: str(raw["number"]),
+    '/issue_author': lambda raw: raw["user"]["login"],
+    '/issue_title': lambda raw: raw["title"],
+    '/issue_description': lambda raw: raw["body"] or "",
+    '/issue_link': lambda raw: raw["html_url"],
+    '/issue_repository': lambda raw: raw["repository_url"].rsplit("/", 1)[-1],
+    '/issue_updated_at': lambda raw: format_date(raw["updated_at"]),
+    '/issue_created_at': lambda raw: format_date(raw["created_at"]),
+}
+label_fields = ['/issue_label', '/feature']
+# Longest placeholders first, so that a placeholder is never matched by a shorter prefix of it
+placeholder_pattern = re.compile("|".join(re.escape(placeholder) for placeholder in
+                                          sorted(list(issue_fields) + label_fields, key=len, reverse=True)))
+
+
+@lru_cache(maxsize=256)
+def compile_template(template):
+    # Even positions of the plan are literal strings, odd positions are placeholders
+    plan = placeholder_pattern.split(template)
+    placeholders = placeholder_pattern.findall(template)
+    for index, placeholder in enumerate(placeholders):
+        plan.insert(2 * index + 1, placeholder)
+    return tuple(plan), frozenset(placeholders)
 
 
 # Template string formatting function for replacing placeholders with actual data
 def format_template(issue, template, label_or_feature=None):
-    """
-    Also handling the edge case where some issues might not have a description (body), but the template string specified
-    in the Bot/config.json for lingering issues uses the /issue_description placeholder, in which case the placeholder
-    will be replaced with the empty string in the generated email body, to avoid any errors.
-    """
-    formatted_template = (template.replace('/issue_number', str(issue.number))
-                                  .replace('/issue_author', issue.user.login)
-                                  .replace('/issue_title', issue.title)
-                                  .replace('/issue_description', issue.body or "")
-                                  .replace('/issue_link', issue.html_url)
-                                  .replace('/issue_repository', issue.repository.name)
-                                  .replace('/issue_updated_at', str(issue.updated_at))
-                                  .replace('/issue_created_at', str(issue.created_at)))
-    if label_or_feature is not None:
-        formatted_template = (formatted_template.replace('/issue_label', label_or_feature)
-                                                .replace('/feature', label_or_feature))
-
-    return formatted_template
+    plan, placeholders = compile_template(template)
+    raw = issue.raw_data
+    values = {placeholder: issue_fields[placeholder](raw) for placeholder in placeholders if placeholder in issue_fields}
+    for placeholder in label_fields:
+        # Without a label or feature, the placeholder stays in the email body as is
+        values[placeholder] = label_or_feature if label_or_feature is not None else placeholder
+    return "".join(part if index % 2 == 0 else values[part] for index, part in enumerate(plan))
 
 
 # Prepare email content for label case
@@ -49,8 +92,7 @@ def prepare_label_email(issue_list, email_info, label):
     issue = issue_list[0]
     # Replace placeholders in the email body template with actual data from the label and issue
     formatted_body = format_template(issue, body, label)
-    # MIMEText used to create the email object
-    return MIMEText(formatted_body), subject
+    return formatted_body, subject
 
 
 # Prepare email content for lingering case
@@ -59,12 +101,39 @@ def prepare_lingering_email(issue_list, email_info):
     body_main = email_info['email-body-template']['lingering'][0]
     body_issue = email_info['email-body-template']['lingering'][1]
     subject = email_info['email-subject-template']['lingering']
-    # Replace placeholders in the lingering issue template with actual data from the issue, for each of the lingering issues identified by the bot
-    formatted_body_issues = "".join([format_template(issue, body_issue) for issue in issue_list])
-    # Replace the '{}' in the main template string for the email body with the string above
-    formatted_body_main = body_main.format(formatted_body_issues)
-    # MIMEText used to create the email object
-    return MIMEText(formatted_body_main), subject
+    # At most lingering-issue-limit issues are listed in the email (all of them if it is not set)
+    limit = email_info.get('lingering-issue-limit')
+    # The main template string for the email body contains '{}' where the lingering issues are listed
+    before_issues, after_issues = split_lingering_template(body_main)
+    if after_issues is None:
+        return before_issues, subject
+    # The email body is written piece by piece, instead of building the list of issues and then copying it into the body
+    body = io.StringIO()
+    body.write(before_issues)
+    listed = 0
+    for issue in issue_list:
+        if limit is not None and listed >= limit:
+            break
+        # Replace placeholders in the lingering issue template with actual data from the issue
+        body.write(format_template(issue, body_issue))
+        listed += 1
+    if listed < len(issue_list):
+        body.write(f"- ... and {len(issue_list) - listed} more lingering issue(s)\n")
+    body.write(after_issues)
+    return body.getvalue(), subject
+
+
+@lru_cache(maxsize=256)
+def split_lingering_template(template):
+    # Same result as template.format(issues): the text around '{}', with '{{' and '}}' unescaped
+    parts = [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+    field_index = next((index for index, (_, field) in enumerate(parts) if field is not None), None)
+    if field_index is None:
+        # Like str.format, a template without '{}' does not list the issues
+        return "".join(literal for literal, _ in parts), None
+    before = "".join(literal for literal, _ in parts[:field_index + 1])
+    after = "".join(literal for literal, _ in parts[field_index + 1:])
+    return before, after
 
 
 # Prepare email content for feature under development case
@@ -77,8 +146,7 @@ def prepare_feature_email(issue_list, email_info):
     issue = issue_list[0]
     # Replace placeholders in the email body template with actual data from the feature and issue
     formatted_body = format_template(issue, body, feature)
-    # MIMEText used to create the email object
-    return MIMEText(formatted_body), subject
+    return formatted_body, subject
 
 
 # Mail sending function
@@ -86,18 +154,6 @@ def send_email(issue_list, config, case, label=None):
     email_info = config['email-info']
     recipients = email_info['recipients']
 
-    try:
-        # Establish the SMTP connection to specified server over a secure SSL connection
-        smtp = smtplib.SMTP_SSL(email_server, email_server_port)
-        # Log in on the SMTP server using the specified bot email address and bot email password
-        smtp.login(bot_email_address, bot_email_password)
-    except smtplib.SMTPAuthenticationError as e:
-        print("SMTP authentication error:", e, flush=True)
-        return
-    except Exception as e:
-        print("Authentication error:", e, flush=True)
-        return
-
     """
     Create the email message for a label:
     - if the practitioner wants to receive any kind of label generated by the ML model for the issue (by setting the
@@ -116,7 +172,7 @@ def send_email(issue_list, config, case, label=None):
         if (email_info["which-labels"] == "all"
                 or (email_info["which-labels"] == "except" and label not in email_info["except-labels"])
                 or (email_info["which-labels"] == "specific" and label in email_info["specific-labels"])):
-            email, subject = prepare_label_email(issue_list, email_info, label)
+            body, subject = prepare_label_email(issue_list, email_info, label)
         else:
             if email_info["which-labels"] == "except":
                 print(f"Generated label: {label} is contained in the 'except-labels' list specified in config.json,"
@@ -124,8 +180,6 @@ def send_email(issue_list, config, case, label=None):
             if email_info["which-labels"] == "specific":
                 print(f"Generated label: {label} is not contained in the 'specific-labels' list specified in config.json,"
                       " no email sent", flush=True)
-            # Close the SMTP connection since no email will be sent
-            smtp.quit()
             return
 
     """
@@ -133,7 +187,7 @@ def send_email(issue_list, config, case, label=None):
     """
     # Lingering case
     if case == 1:
-        email, subject = prepare_lingering_email(issue_list, email_info)
+        body, subject = prepare_lingering_email(issue_list, email_info)
 
     """
     Create the email message for a feature under development:
@@ -148,37 +202,19 @@ def send_email(issue_list, config, case, label=None):
         issue = issue_list[0]
         if label:
             if label == email_info["feature-under-development"]: # IDEA: or email_info["feature"] in label, in case the feature can be a substring of the label
-                email, subject = prepare_feature_email(issue_list, email_info)
+                body, subject = prepare_feature_email(issue_list, email_info)
             else:
                 print(f"Recently added label: {label} to issue #{issue.number} does not mention the feature under "
                       "development, no email sent", flush=True)
-                # Close the SMTP connection since no email will be sent
-                smtp.quit()
                 return
         else:
             # Case-insensitive check if the feature under development is contained in the body of the issue
             if issue.body is not None and email_info["feature-under-development"].lower() in issue.body.lower():
-                email, subject = prepare_feature_email(issue_list, email_info)
+                body, subject = prepare_feature_email(issue_list, email_info)
             else:
                 print(f"Newly created issue #{issue.number} does not mention the feature under development in its body"
                       " no email sent", flush=True)
-                # Close the SMTP connection since no email will be sent
-                smtp.quit()
                 return
 
-    email['From'] = bot_name
-    email['To'] = ', '.join(recipients)
-    email['Subject'] = subject
-
-    # After the email is created, send it using the SMTP connection to the specified recipients; also error handling
-    try:
-        smtp.sendmail(bot_email_address, recipients, email.as_string())
-        print("Email sent successfully!", flush=True)
-    except smtplib.SMTPException as error:
-        print(f"SMTP mail sending error: {error}", flush=True)
-    except Exception as error:
-        print(f"Mail sending error: {error}", flush=True)
-
-    # Close the SMTP connection after sending the email(s)
-    smtp.quit()
-    
\ No newline at end of file
+    # The email is only queued here, it is sent by the background thread of the outbox
+    outbox.submit(recipients, subject, body)
@@ -0,0 +1,373 @@
+import threading
+import time
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from github import Auth, Github, GithubRetry
+
+"""
+* Shared access to the GitHub API for the bot's GitHub App installations.
+* Installation access tokens are valid for one hour, so instead of minting a new token (a JWT signature and a GitHub
+  round trip) for every webhook event or repository, each token is cached per installation ID and refreshed shortly
+  before it expires.
+* The owner/repository -> installation ID mapping is cached as well, and every installation gets a single Github client
+  (and HTTP connection pool) that is reused between events, since its authentication always reads the current token.
+* The rate limit of each installation is shared by interactive work (webhook events: labeling, /tdbot commands) and
+  background work (lingering issues scans). Every request of a background job first goes through the budget of its
+  installation, which holds it back while interactive work of the installation is in progress (for at most
+  MAX_INTERACTIVE_WAIT seconds in a row, so that background work is never starved), while only a reserve of the
+  remaining requests (X-RateLimit-Remaining) is left before the reset (X-RateLimit-Reset), and after a secondary rate
+  limit, for a backoff that doubles while secondary rate limits keep occurring.
+"""
+
+# Longest time background requests wait in a row for the interactive work of their installation
+MAX_INTERACTIVE_WAIT = 30
+# The secondary rate limit backoff goes back to its initial value after this many seconds without secondary rate limits
+SECONDARY_BACKOFF_RECOVERY = 600
+
+
+class InstallationBudget:
+    def __init__(self, max_background_concurrency, reserve, calls_per_background_job, secondary_backoff=60,
+                 max_secondary_backoff=900):
+        self.client = None
+        self._max_background_concurrency = max_background_concurrency
+        self._reserve = reserve
+        self._calls_per_background_job = calls_per_background_job
+        self._initial_secondary_backoff = secondary_backoff
+        self._secondary_backoff = secondary_backoff
+        self._max_secondary_backoff = max_secondary_backoff
+        self._condition = threading.Condition()
+        self._interactive = 0
+        # Until when the interactive work in progress holds back background requests (see _interactive_priority)
+        self._interactive_priority_until = None
+        self._background_jobs = 0
+        self._backoff_until = 0
+        self._last_secondary_limit = 0
+        self._stats = {"interactive_requests": 0, "background_requests": 0, "background_waits": 0,
+                       "primary_rate_limits": 0, "secondary_rate_limits": 0}
+
+    """
+    Remaining requests and reset time, as reported by the X-RateLimit headers of the latest response. PyGithub requests
+    the rate limit when no response was received yet, so it is never called while holding the condition.
+    """
+    def _rate_limit(self):
+        remaining, limit = self.client.rate_limiting
+        return remaining, limit, self.client.rate_limiting_resettime
+
+    def _refresh_rate_limit(self):
+        # Requesting the rate limit does not count against it
+        self.client.get_rate_limit()
+
+    # Called while holding the condition; the caller refreshes the rate limit once it released it
+    def _wait_for_reset(self, reset):
+        delay = max(1, reset - time.time())
+        print(f"GitHub API rate limit almost reached, waiting {int(delay)}s for it to reset", flush=True)
+        self._stats["background_waits"] += 1
+        self._condition.wait(delay)
+
+    @contextmanager
+    def interactive(self):
+        with self._condition:
+            self._interactive += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._interactive -= 1
+                self._condition.notify_all()
+
+    """
+    Whether the interactive work in progress holds back background requests. All the background requests of the
+    installation share the deadline: once they were held back for MAX_INTERACTIVE_WAIT seconds in a row, they proceed
+    for as long before waiting for interactive work again, so that continuous interactive work cannot starve them.
+    """
+    def _interactive_priority(self, now):
+        if self._interactive_priority_until is None or now >= self._interactive_priority_until + MAX_INTERACTIVE_WAIT:
+            self._interactive_priority_until = now + MAX_INTERACTIVE_WAIT
+        return now < self._interactive_priority_until
+
+    """
+    A background job (e.g. the lingering issues of a repository) only starts when the remaining requests of the
+    installation, minus the reserve, are enough for one more concurrent job.
+    """
+    def start_background_job(self):
+        while True:
+            remaining, _, reset = self._rate_limit()
+            with self._condition:
+                if self._background_jobs < self._allowed_background_jobs(remaining):
+                    self._background_jobs += 1
+                    return
+                if self._background_jobs > 0:
+                    # Wait for a running job of the installation to finish (or for its responses to update the budget)
+                    self._condition.wait(5)
+                    continue
+                self._wait_for_reset(reset)
+            self._refresh_rate_limit()
+
+    def _allowed_background_jobs(self, remaining):
+        return max(0, min(self._max_background_concurrency,
+                          (remaining - self._reserve) // self._calls_per_background_job))
+
+    """
+    Starts a background job if the remaining requests of the installation allow one more right now, without waiting;
+    returns whether it did.
+    """
+    def try_start_background_job(self):
+        remaining, _, reset = self._rate_limit()
+        if reset <= time.time():
+            # The rate limit was reset since the latest response
+            self._refresh_rate_limit()
+            remaining, _, reset = self._rate_limit()
+        with self._condition:
+            if self._background_jobs < self._allowed_background_jobs(remaining):
+                self._background_jobs += 1
+                return True
+            return False
+
+    def finish_background_job(self):
+        with self._condition:
+            self._background_jobs -= 1
+            self._condition.notify_all()
+
+    def before_request(self, background):
+        with self._condition:
+            if not background:
+                self._stats["interactive_requests"] += 1
+                return
+            self._stats["background_requests"] += 1
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                if now < self._backoff_until:
+                    self._stats["background_waits"] += 1
+                    self._condition.wait(self._backoff_until - now)
+                    continue
+                if self._interactive == 0:
+                    self._interactive_priority_until = None
+                elif self._interactive_priority(now):
+                    self._stats["background_waits"] += 1
+                    self._condition.wait(self._interactive_priority_until - now)
+                    continue
+            remaining, _, reset = self._rate_limit()
+            if remaining > self._reserve or reset <= time.time():
+                return
+            with self._condition:
+                self._wait_for_reset(reset)
+            self._refresh_rate_limit()
+
+    def on_rate_limited(self, secondary):
+        with self._condition:
+            if not secondary:
+                self._stats["primary_rate_limits"] += 1
+                return
+            self._stats["secondary_rate_limits"] += 1
+            now = time.monotonic()
+            if now - self._last_secondary_limit > SECONDARY_BACKOFF_RECOVERY:
+                self._secondary_backoff = self._initial_secondary_backoff
+            elif now >= self._backoff_until:
+                self._secondary_backoff = min(2 * self._secondary_backoff, self._max_secondary_backoff)
+            self._last_secondary_limit = now
+            self._backoff_until = max(self._backoff_until, now + self._secondary_backoff)
+            print(f"GitHub API secondary rate limit reached, holding back background requests for "
+                  f"{self._secondary_backoff}s", flush=True)
+
+    def stats(self):
+        remaining, limit, reset = self._rate_limit()
+        with self._condition:
+            return {
+                **self._stats,
+                "remaining": remaining,
+                "limit": limit,
+                "used_fraction": (limit - remaining) / limit if limit > 0 else None,
+                "reset": reset,
+                "interactive_in_progress": self._interactive,
+                "background_jobs_in_progress": self._background_jobs,
+                "secondary_backoff_s": max(0.0, self._backoff_until - time.monotonic()),
+            }
+
+
+class AccountingRetry(GithubRetry):
+    """PyGithub's retry policy (which waits out rate limits), also reporting the rate limits to a budget"""
+
+    def __init__(self, budget=None, **kwargs):
+        self.budget = budget
+        super().__init__(**kwargs)
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.budget = self.budget
+        return retry
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        # PyGithub only retries a 403 response when it is a rate limit error
+        if response is not None and response.status == 403 and self.budget is not None:
+            self.budget.on_rate_limited(response.headers.get("X-RateLimit-Remaining") != "0")
+        return retry
+
+
+class CachedInstallationAuth(Auth.Auth):
+    def __init__(self, github_access, installation_id):
+        self._github_access = github_access
+        self._installation_id = installation_id
+
+    @property
+    def token_type(self):
+        return "token"
+
+    @property
+    def token(self):
+        # Read by PyGithub before every request, which makes it the place where requests are accounted for
+        self._github_access.before_request(self._installation_id)
+        return self._github_access.token(self._installation_id)
+
+
+class GitHubAccess:
+    def __init__(self, git_integration, token_refresh_margin=300, installation_ttl=3600, pool_size=10,
+                 max_background_concurrency=4, rate_limit_reserve=1000, calls_per_background_job=100):
+        self.integration = git_integration
+        # Tokens are refreshed token_refresh_margin seconds before they expire
+        self._token_refresh_margin = timedelta(seconds=token_refresh_margin)
+        self._installation_ttl = installation_ttl
+        self._pool_size = pool_size
+        # Background jobs leave rate_limit_reserve requests of each installation for interactive work, and are assumed
+        # to need calls_per_background_job requests each
+        self._max_background_concurrency = max_background_concurrency
+        self._rate_limit_reserve = rate_limit_reserve
+        self._calls_per_background_job = calls_per_background_job
+        self._lock = threading.Lock()
+        self._token_locks = {}
+        self._tokens = {}
+        self._clients = {}
+        self._budgets = {}
+        self._installations = {}
+        # Whether the current thread runs a background job, and whether it is checking a budget
+        self._local = threading.local()
+
+    def installation_id(self, owner, repo_name):
+        key = (owner.lower(), repo_name.lower())
+        with self._lock:
+            cached = self._installations.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self._installation_ttl:
+            return cached[0]
+        installation_id = self.integration.get_installation(owner, repo_name).id
+        with self._lock:
+            self._installations[key] = (installation_id, time.monotonic())
+        return installation_id
+
+    def token(self, installation_id):
+        with self._lock:
+            token_lock = self._token_locks.setdefault(installation_id, threading.Lock())
+        # Only one thread mints the token of an installation, the others wait for it and reuse it
+        with token_lock:
+            authorization = self._tokens.get(installation_id)
+            if authorization is None or authorization.expires_at - self._token_refresh_margin <= datetime.now(
+                    timezone.utc):
+                authorization = self.integration.get_access_token(installation_id)
+                self._tokens[installation_id] = authorization
+            return authorization.token
+
+    def _client_and_budget(self, installation_id):
+        with self._lock:
+            client = self._clients.get(installation_id)
+            if client is None:
+                budget = InstallationBudget(self._max_background_concurrency, self._rate_limit_reserve,
+                                            self._calls_per_background_job)
+                client = Github(auth=CachedInstallationAuth(self, installation_id), pool_size=self._pool_size,
+                                retry=AccountingRetry(budget=budget))
+                budget.client = client
+                self._clients[installation_id] = client
+                self._budgets[installation_id] = budget
+            return client, self._budgets[installation_id]
+
+    def client(self, installation_id):
+        return self._client_and_budget(installation_id)[0]
+
+    @contextmanager
+    def _checking_budget(self):
+        # Requests made while checking a budget (e.g. fetching the rate limit) are not checked themselves
+        self._local.checking = True
+        try:
+            yield
+        finally:
+            self._local.checking = False
+
+    def before_request(self, installation_id):
+        if getattr(self._local, "checking", False):
+            return
+        with self._checking_budget():
+            self._client_and_budget(installation_id)[1].before_request(getattr(self._local, "background", False))
+
+    """
+    Context manager for interactive work on the installation (e.g. a webhook event), during which the requests of its
+    background jobs are held back.
+    """
+    def interactive(self, installation_id):
+        return self._client_and_budget(installation_id)[1].interactive()
+
+    """
+    Context manager for a background job of the installation: waits while the installation's remaining rate limit does
+    not allow one more concurrent job, and marks the requests of the current thread as background requests.
+    """
+    @contextmanager
+    def background(self, installation_id):
+        budget = self._client_and_budget(installation_id)[1]
+        with self._checking_budget():
+            budget.start_background_job()
+        with self._background_job(budget):
+            yield
+
+    """
+    Starts a background job of the installation if its remaining rate limit allows one more concurrent job right now,
+    without waiting (e.g. to process another installation meanwhile); returns whether it did. A started job is run
+    within started_background_job.
+    """
+    def try_start_background_job(self, installation_id):
+        budget = self._client_and_budget(installation_id)[1]
+        with self._checking_budget():
+            return budget.try_start_background_job()
+
+    """
+    Context manager for a background job started by try_start_background_job: marks the requests of the current thread
+    as background requests, and finishes the job at the end.
+    """
+    def started_background_job(self, installation_id):
+        return self._background_job(self._client_and_budget(installation_id)[1])
+
+    @contextmanager
+    def _background_job(self, budget):
+        try:
+            with self.background_requests():
+                yield
+        finally:
+            budget.finish_background_job()
+
+    """
+    Context manager marking the requests of the current thread as background requests, without starting a background
+    job (e.g. for the thread that coordinates the background jobs of a long-running task).
+    """
+    @contextmanager
+    def background_requests(self):
+        self._local.background = True
+        try:
+            yield
+        finally:
+            self._local.background = False
+
+    """
+    Called when the GitHub App is uninstalled/suspended or its repositories change, so that no stale installation ID
+    or token is used afterwards.
+    """
+    def invalidate_installation(self, installation_id):
+        with self._lock:
+            self._tokens.pop(installation_id, None)
+            self._clients.pop(installation_id, None)
+            self._budgets.pop(installation_id, None)
+            self._installations = {key: value for key, value in self._installations.items()
+                                   if value[0] != installation_id}
+
+    def stats(self):
+        with self._lock:
+            budgets = dict(self._budgets)
+        with self._checking_budget():
+            return {str(installation_id): budget.stats() for installation_id, budget in budgets.items()}
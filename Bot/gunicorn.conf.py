@@ -0,0 +1,11 @@
+"""
+* gunicorn settings of the bot (see the Dockerfile). The app is loaded once in the master process (--preload) and the
+  worker process is forked from it.
+* Background threads do not survive the fork, so the scheduler of the lingering issues jobs is started in the worker,
+  which serves the webhooks, once it is forked.
+"""
+
+
+def post_fork(server, worker):
+    import app
+    app.start_background_jobs()
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+"""
+* Cache of the labels returned by the ML model endpoints, so that labeling an unchanged text again (e.g. "/tdbot label"
+  run several times on the same issue, or a reopened issue) reuses the previous label without a request to the backend.
+* Labels are keyed by a hash of the "payload-type", "endpoint" and "label-location" fields of the repository's config
+  and of the text. Changing these fields in config.json therefore never reuses the labels of the previous config, whose
+  entries are evicted over time.
+* The labels are kept in memory for ttl seconds (at most max_entries of them, the least recently used are evicted
+  first). With a path, they are also stored in a sqlite database, so that they survive restarts of the bot.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    key TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    stored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS labels_stored_at ON labels (stored_at);
+"""
+
+# Expired labels are deleted from the database at most once per this many seconds
+EVICTION_INTERVAL = 600
+
+
+class LabelCache:
+    def __init__(self, ttl=86400, max_entries=10000, path=None):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._path = path
+        self._lock = threading.Lock()
+        self._labels = OrderedDict()
+        self._last_eviction = 0
+        self._stats = {"hits": 0, "misses": 0}
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connect() as connection:
+                connection.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self._path, timeout=30)
+
+    @staticmethod
+    def key(config, text):
+        digest = hashlib.sha256()
+        for part in (config["payload-type"], config["endpoint"], config["label-location"], text):
+            digest.update(part.encode("utf-8", "surrogatepass"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._labels.get(key)
+            if entry is None and self._path is not None:
+                with self._connect() as connection:
+                    entry = connection.execute("SELECT label, stored_at FROM labels WHERE key = ?", (key,)).fetchone()
+                if entry is not None:
+                    self._remember(key, entry)
+            if entry is None or now - entry[1] >= self._ttl:
+                self._stats["misses"] += 1
+                return None
+            self._labels.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key, label):
+        now = time.time()
+        with self._lock:
+            self._remember(key, (label, now))
+            if self._path is not None:
+                with self._connect() as connection:
+                    if now - self._last_eviction >= EVICTION_INTERVAL:
+                        connection.execute("DELETE FROM labels WHERE stored_at < ?", (now - self._ttl,))
+                        self._last_eviction = now
+                    connection.execute("INSERT OR REPLACE INTO labels VALUES (?, ?, ?)", (key, label, now))
+
+    def _remember(self, key, entry):
+        self._labels[key] = entry
+        self._labels.move_to_end(key)
+        while len(self._labels) > self._max_entries:
+            self._labels.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {**self._stats, "hit_rate": self._stats["hits"] / lookups if lookups else None,
+                    "entries": len(self._labels)}
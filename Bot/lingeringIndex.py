@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import threading
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+"""
+* Persistent index of the open issues of each repository, used to find lingering issues without crawling the events and
+  comments of every open issue on every run.
+* For each repository, the index stores a high-water mark (the time of its last scan) and, for each open issue, the data
+  needed for the lingering issues emails and the time of the last human activity on the issue.
+* A scan only fetches the issues updated since the high-water mark, and only their last human activity is recomputed.
+  Every full_scan_interval days, a full scan of the open issues replaces the index of the repository, so that deleted or
+  transferred issues (which no "since" query returns) eventually leave the index. It keeps the last human activity of
+  the issues whose updated_at did not change, so it only recomputes it for new and updated issues too.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS repositories (
+    repository TEXT PRIMARY KEY,
+    high_water_mark TEXT NOT NULL,
+    last_full_scan TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS issues (
+    repository TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    body TEXT,
+    author TEXT NOT NULL,
+    html_url TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    last_activity TEXT,
+    PRIMARY KEY (repository, number)
+);
+"""
+
+
+class LingeringIndex:
+    def __init__(self, path, full_scan_interval=7):
+        self._path = path
+        self._full_scan_interval = timedelta(days=full_scan_interval)
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self._path, timeout=30)
+
+    """
+    Brings the index of the repository up to date and returns the number of issues fetched from GitHub.
+    last_modified(issue) computes the time of the last human activity on an issue, it is only called when track_activity
+    is set (i.e. for the "last-modified" lingering mode).
+    """
+    def scan(self, repo, last_modified, track_activity, now):
+        repository = repo.full_name
+        with self._connect() as connection:
+            row = connection.execute("SELECT high_water_mark, last_full_scan FROM repositories WHERE repository = ?",
+                                     (repository,)).fetchone()
+        full_scan = row is None or now - datetime.fromisoformat(row[1]) >= self._full_scan_interval
+        if full_scan:
+            issues = repo.get_issues(state="open")
+        else:
+            # Closed issues are also returned, so that they can be removed from the index
+            issues = repo.get_issues(state="all", since=datetime.fromisoformat(row[0]))
+
+        # The last human activity of an indexed issue that was not updated since it was indexed is still valid, so a full
+        # scan only recomputes it for new and updated issues
+        with self._connect() as connection:
+            indexed = {number: (updated_at, last_activity) for number, updated_at, last_activity in connection.execute(
+                "SELECT number, updated_at, last_activity FROM issues WHERE repository = ?", (repository,))}
+
+        fetched = 0
+        updated = []
+        closed = []
+        for issue in issues:
+            fetched += 1
+            if issue.state != "open":
+                closed.append((repository, issue.number))
+                continue
+            last_activity = None
+            if track_activity:
+                updated_at, last_activity = indexed.get(issue.number, (None, None))
+                if last_activity is None or updated_at != issue.updated_at.isoformat():
+                    last_activity = last_modified(issue).isoformat()
+            updated.append((repository, issue.number, issue.title, issue.body, issue.user.login, issue.html_url,
+                            issue.created_at.isoformat(), issue.updated_at.isoformat(), last_activity))
+
+        with self._lock, self._connect() as connection:
+            if full_scan:
+                connection.execute("DELETE FROM issues WHERE repository = ?", (repository,))
+            connection.executemany("DELETE FROM issues WHERE repository = ? AND number = ?", closed)
+            connection.executemany("INSERT OR REPLACE INTO issues VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", updated)
+            connection.execute(
+                "INSERT INTO repositories VALUES (?, ?, ?) ON CONFLICT (repository) DO UPDATE SET "
+                "high_water_mark = excluded.high_water_mark, last_full_scan = "
+                + ("excluded.last_full_scan" if full_scan else "last_full_scan"),
+                (repository, now.isoformat(), now.isoformat()))
+
+        if track_activity:
+            fetched += self._fill_missing_activity(repo, last_modified)
+        return fetched
+
+    """
+    Issues indexed while the repository used the "creation-date" lingering mode have no last human activity yet.
+    """
+    def _fill_missing_activity(self, repo, last_modified):
+        with self._connect() as connection:
+            numbers = [number for number, in connection.execute(
+                "SELECT number FROM issues WHERE repository = ? AND last_activity IS NULL", (repo.full_name,))]
+        activities = [(last_modified(repo.get_issue(number)).isoformat(), repo.full_name, number) for number in numbers]
+        with self._lock, self._connect() as connection:
+            connection.executemany("UPDATE issues SET last_activity = ? WHERE repository = ? AND number = ?",
+                                   activities)
+        return len(numbers)
+
+    """
+    Issues of the repository whose creation date (lingering_mode "creation-date") or last human activity (lingering_mode
+    "last-modified") is at least threshold days old. Issues whose last human activity is not known yet (e.g. its
+    computation failed during the scan) are left for the next run, which computes it. The issues only carry the number
+    and the raw GitHub data used by the email templates.
+    """
+    def lingering_issues(self, repo, lingering_mode, threshold, now):
+        column = "last_activity" if lingering_mode == "last-modified" else "created_at"
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT number, title, body, author, html_url, created_at, updated_at, " + column +
+                " FROM issues WHERE repository = ? AND " + column + " IS NOT NULL ORDER BY number",
+                (repo.full_name,)).fetchall()
+        return [
+            SimpleNamespace(number=number, raw_data={
+                "number": number, "title": title, "body": body, "user": {"login": author}, "html_url": html_url,
+                "repository_url": repo.url, "created_at": created_at, "updated_at": updated_at})
+            for number, title, body, author, html_url, created_at, updated_at, issue_time in rows
+            # Calculate how many days have passed since the issue has been created/has been last modified
+            if (now - datetime.fromisoformat(issue_time)).days >= threshold
+        ]
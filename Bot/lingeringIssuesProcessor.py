@@ -1,10 +1,11 @@
-import json
-import base64
 import pytz # Used for timezone handling
+import time
 
-from github import Github, GithubIntegration
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 from emailSender import send_email
+from metrics import LINGERING_RUN_SECONDS
 
 """
 * Function to determine the last time an issue has been modified (by a user, not by the bot), either by creating a 
@@ -65,71 +66,128 @@ def obtain_installations(git_integration):
     + The issues that are found to be lingering are the ones that practitioners will be notified about, by sending them 
       emails.
 """
-def process_lingering_issues(git_integration, lingering_check_frequency):
-
-    repositories_info = obtain_installations(git_integration)
-
-    # Iterate over each repository that has the bot's GitHub App installed
-    for repository_name, repository_owner, installation_id in repositories_info:
-        print(f"Processing lingering issues in the {repository_name} repository...", flush=True)
-
-        # Get a git connection as our bot
-        git_connection = Github(login_or_token=git_integration.get_access_token(installation_id).token)
-
-        repo = git_connection.get_repo(f"{repository_owner}/{repository_name}")
-        # If repo has config.json file in the Bot directory, use it. Otherwise, use the config.json file locally in the bot
-        try:
-            config_file = repo.get_contents("Bot/config.json")
-            print("Using config file from the repository", flush=True)
-            # Decode the file
-            config = json.loads(base64.b64decode(config_file.content).decode("utf-8"))
-        except:
-            with open("config.json", "r") as f:
-                config = json.load(f)
-                print("Using config file from the local Bot directory as it is not present in the repository", flush=True)
-
-        # Send email if emails for lingering issues/all types of emails are enabled in config.json
-        if config["send-emails"] == True and config["when-to-send"] in ["lingering", "all"]:
-            print("Sending emails for lingering issues enabled", flush=True)
-            # Obtain all open issues in the current repository
-            issues = repo.get_issues(state="open")
-            email_info = config["email-info"]
-            lingering_issue_threshold = email_info["lingering-issue-threshold"]
-            lingering_mode = email_info["lingering-mode"]
-            # Determine the appropriate function to get the issue time based on lingering_mode
-            if lingering_mode == "last-modified":
-                get_issue_time = lambda issue: issue_last_modified(issue)
-            elif lingering_mode == "creation-date":
-                get_issue_time = lambda issue: issue.created_at
-            else:
-                """
-                Lingering mode is neither "last-modified", nor "creation-date", so we return early and we don't check 
-                for lingering issues anymore.
-                """
-                print(f"Lingering mode: {lingering_mode} is not a valid mode, please refer to the bot documentation.",
-                      flush=True)
-                return
-            print(f"Using lingering mode: {lingering_mode}", flush=True)
-            # Obtain the current time and make it timezone-aware in UTC
-            current_time = datetime.utcnow().replace(tzinfo=pytz.UTC)
-            lingering_issues = []
-            # Iterate through all open issues in the current repository
-            for issue in issues:
-                issue_time = get_issue_time(issue)
-                # Calculate how many days have passed since the issue has been created/has been last modified
-                days_passed = (current_time - issue_time).days
-                """
-                If the issue has been created/has not been modified for more days than the given threshold, add it to 
-                the list of lingering issues.
-                """
-                if days_passed >= lingering_issue_threshold:
-                    # Add lingering issue to the lingering_issues list
-                    lingering_issues.append(issue)
-            print(f"Found {len(lingering_issues)} lingering issue(s)", flush=True)
-            # Send email for lingering issues, if any
-            if len(lingering_issues) > 0:
-                print("Sending email...", flush=True)
-                send_email(lingering_issues, config, 1)
-        else:
-            print(f"Sending emails for lingering issues disabled, checking again in {lingering_check_frequency} day(s)",
-                  flush=True)
\ No newline at end of file
+def process_lingering_issues(github_access, config_cache, lingering_index, lingering_check_frequency, workers=4):
+    with LINGERING_RUN_SECONDS.time():
+        process_installations(github_access, config_cache, lingering_index, lingering_check_frequency, workers)
+
+
+# Seconds between two checks of the installations whose rate limit does not allow one more background job
+THROTTLED_RECHECK_INTERVAL = 5
+
+
+"""
+* The repositories are processed by a pool of workers shared by all the installations. A repository only takes a worker
+  once the rate limit of its installation allows one more background job (see githubAccess.py), so that an installation
+  whose rate limit is used up waits for its reset without holding the workers the other installations need.
+* The installations take turns, one repository each, while workers are available.
+"""
+def process_installations(github_access, config_cache, lingering_index, lingering_check_frequency, workers):
+    # Repositories waiting to be processed, per installation
+    pending = {}
+    for repository_name, repository_owner, installation_id in obtain_installations(github_access.integration):
+        pending.setdefault(installation_id, deque()).append((repository_name, repository_owner))
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lingering") as executor:
+        while pending or running:
+            # Passes over the installations, as long as they start repositories and workers are available
+            started_any = True
+            while started_any and len(running) < workers:
+                started_any = False
+                for installation_id in list(pending):
+                    if len(running) >= workers:
+                        break
+                    try:
+                        started = github_access.try_start_background_job(installation_id)
+                    except Exception as e:
+                        print(f"Checking the rate limit of installation {installation_id} failed: {e}, skipping its "
+                              f"repositories", flush=True)
+                        del pending[installation_id]
+                        continue
+                    if not started:
+                        continue
+                    repository_name, repository_owner = pending[installation_id].popleft()
+                    # Moved to the end, so that the other installations get the next workers
+                    repositories = pending.pop(installation_id)
+                    if repositories:
+                        pending[installation_id] = repositories
+                    future = executor.submit(process_repository, github_access, config_cache, lingering_index,
+                                             lingering_check_frequency, repository_name, repository_owner,
+                                             installation_id)
+                    running[future] = repository_name
+                    started_any = True
+
+            if not running:
+                # Every installation with pending repositories is throttled
+                time.sleep(THROTTLED_RECHECK_INTERVAL)
+                continue
+            done, _ = wait(running, timeout=THROTTLED_RECHECK_INTERVAL if pending else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                repository_name = running.pop(future)
+                # A failure in one repository does not stop the processing of the other repositories
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Processing lingering issues in the {repository_name} repository failed: {e}", flush=True)
+
+
+"""
+* Processes the lingering issues of a single repository (see process_lingering_issues) as a background job of its 
+  installation, started by process_installations: at most as many repositories of the same installation are processed
+  at a time as its remaining GitHub API rate limit allows, and webhook events of the installation have priority over
+  the requests of the job.
+"""
+def process_repository(github_access, config_cache, lingering_index, lingering_check_frequency, repository_name,
+                       repository_owner, installation_id):
+    with github_access.started_background_job(installation_id):
+        process_repository_issues(github_access, config_cache, lingering_index, lingering_check_frequency,
+                                  repository_name, repository_owner, installation_id)
+
+
+def process_repository_issues(github_access, config_cache, lingering_index, lingering_check_frequency, repository_name,
+                              repository_owner, installation_id):
+    print(f"Processing lingering issues in the {repository_name} repository...", flush=True)
+
+    # Get a git connection as our bot
+    git_connection = github_access.client(installation_id)
+
+    repo = git_connection.get_repo(f"{repository_owner}/{repository_name}")
+    # If repo has config.json file in the Bot directory, use it. Otherwise, use the config.json file locally in the bot
+    config = config_cache.get(repo)
+
+    # Send email if emails for lingering issues/all types of emails are enabled in config.json
+    if config["send-emails"] == True and config["when-to-send"] in ["lingering", "all"]:
+        print(f"Sending emails for lingering issues enabled in the {repository_name} repository", flush=True)
+        email_info = config["email-info"]
+        lingering_issue_threshold = email_info["lingering-issue-threshold"]
+        lingering_mode = email_info["lingering-mode"]
+        if lingering_mode not in ["last-modified", "creation-date"]:
+            """
+            Lingering mode is neither "last-modified", nor "creation-date", so we return early and we don't check 
+            for lingering issues in this repository anymore (the other repositories are still processed).
+            """
+            print(f"Lingering mode: {lingering_mode} of the {repository_name} repository is not a valid mode, please "
+                  "refer to the bot documentation.", flush=True)
+            return
+        print(f"Using lingering mode: {lingering_mode} in the {repository_name} repository", flush=True)
+        # Obtain the current time and make it timezone-aware in UTC
+        current_time = datetime.utcnow().replace(tzinfo=pytz.UTC)
+        """
+        Update the index of the open issues of the repository with the issues updated since the last run (the last
+        human activity is only recomputed for these issues), and take the lingering issues from the index: the 
+        issues created/not modified for more days than the given threshold.
+        """
+        fetched = lingering_index.scan(repo, issue_last_modified, lingering_mode == "last-modified", current_time)
+        print(f"Fetched {fetched} issue(s) of the {repository_name} repository updated since the last run",
+              flush=True)
+        lingering_issues = lingering_index.lingering_issues(repo, lingering_mode, lingering_issue_threshold,
+                                                            current_time)
+        print(f"Found {len(lingering_issues)} lingering issue(s) in the {repository_name} repository", flush=True)
+        # Send email for lingering issues, if any
+        if len(lingering_issues) > 0:
+            print("Sending email...", flush=True)
+            send_email(lingering_issues, config, 1)
+    else:
+        print(f"Sending emails for lingering issues disabled in the {repository_name} repository, checking again in "
+              f"{lingering_check_frequency} day(s)", flush=True)
\ No newline at end of file
@@ -0,0 +1,100 @@
+import re
+import time
+
+from github.Requester import HTTPRequestsConnectionClass, HTTPSRequestsConnectionClass, Requester
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+"""
+* Prometheus metrics of the bot, exposed in the Prometheus text format at /metrics.
+* The bot runs a single gunicorn worker process, which serves the webhooks and also runs the background work (webhook
+  queue, email outbox and the scheduler of the lingering issues jobs, started after the fork, see gunicorn.conf.py).
+  The default registry of that process therefore holds all of its metrics; nothing is recorded in the gunicorn master.
+* GitHub API requests are timed by the connection classes of PyGithub, per HTTP method and endpoint. Owners,
+  repositories, numbers and other identifiers are replaced by placeholders in the endpoints, so that the number of time
+  series does not grow with the number of repositories and issues.
+"""
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RUN_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+
+GITHUB_REQUESTS = Counter("bot_github_requests_total", "GitHub API requests", ["method", "endpoint", "status"])
+# The latency they save is estimated with the mean latency of the same endpoints in bot_github_request_seconds
+GITHUB_REQUESTS_AVOIDED = Counter("bot_github_requests_avoided_total",
+                                  "GitHub API requests avoided by using the data of the webhook payloads",
+                                  ["event", "endpoint"])
+GITHUB_REQUEST_SECONDS = Histogram("bot_github_request_seconds", "Latency of the GitHub API requests",
+                                   ["method", "endpoint"], buckets=LATENCY_BUCKETS)
+MODEL_REQUEST_SECONDS = Histogram("bot_model_request_seconds", "Latency of the requests to the ML model endpoints",
+                                  ["kind"], buckets=LATENCY_BUCKETS)
+EMAIL_SEND_SECONDS = Histogram("bot_email_send_seconds", "Time to send an email over SMTP", ["result"],
+                               buckets=LATENCY_BUCKETS)
+WEBHOOK_QUEUE_DEPTH = Gauge("bot_webhook_queue_depth", "Webhook events waiting to be processed")
+LINGERING_RUN_SECONDS = Histogram("bot_lingering_run_seconds", "Duration of the lingering issues runs",
+                                  buckets=RUN_BUCKETS)
+
+# Path segments followed by the number of an issue or pull request, and by a name (other numbers become {id})
+NUMBER_SEGMENTS = ["issues", "pulls"]
+NAME_SEGMENTS = {"labels": "{name}", "users": "{login}", "orgs": "{org}"}
+
+
+def normalize_endpoint(url):
+    segments = url.split("?")[0].strip("/").split("/")
+    normalized = []
+    for index, segment in enumerate(segments):
+        previous = segments[index - 1] if index > 0 else None
+        if index == 1 and previous == "repos":
+            normalized.append("{owner}")
+        elif index == 2 and segments[0] == "repos":
+            normalized.append("{repo}")
+        elif previous == "contents":
+            # Everything after /contents is the path of a file
+            normalized.append("{path}")
+            break
+        elif previous in NAME_SEGMENTS:
+            normalized.append(NAME_SEGMENTS[previous])
+        elif re.fullmatch(r"\d+", segment):
+            normalized.append("{number}" if previous in NUMBER_SEGMENTS else "{id}")
+        else:
+            normalized.append(segment)
+    return "/" + "/".join(normalized)
+
+
+def count_avoided_requests(event, *endpoints):
+    for endpoint in endpoints:
+        GITHUB_REQUESTS_AVOIDED.labels(event, endpoint).inc()
+
+
+class TimedConnectionMixin:
+    def getresponse(self):
+        endpoint = normalize_endpoint(self.url)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = super().getresponse()
+            status = str(response.status)
+            return response
+        finally:
+            GITHUB_REQUEST_SECONDS.labels(self.verb, endpoint).observe(time.perf_counter() - start)
+            GITHUB_REQUESTS.labels(self.verb, endpoint, status).inc()
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPRequestsConnectionClass):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSRequestsConnectionClass):
+    pass
+
+
+"""
+Times the GitHub API requests of the Github clients and integrations created afterwards. PyGithub's
+injectConnectionClasses is meant for tests and would also stop reusing connections between requests, so the connection
+classes are replaced directly.
+"""
+def instrument_github():
+    Requester._Requester__httpConnectionClass = TimedHTTPConnection
+    Requester._Requester__httpsConnectionClass = TimedHTTPSConnection
+
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,163 @@
+import threading
+import time
+
+import requests
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from labelCache import LabelCache
+from metrics import MODEL_REQUEST_SECONDS
+
+"""
+* Client for the ML model endpoints configured in the "endpoint" field of config.json.
+* All requests go through one keep-alive session with a connection pool, are bounded by a connect/read timeout, and are
+  retried with exponential backoff when the connection fails or the backend is temporarily unavailable (e.g. a model
+  that is still loading answers 503).
+* Several texts of the same issue (e.g. its title and description) are labeled in a single request to the batch endpoint
+  of the backend (<endpoint>/batch). Backends without a batch endpoint get one request per text, sent concurrently.
+* With a label cache, texts labeled before with the same config are not sent to the backend again.
+"""
+
+# Status codes of a backend without a batch endpoint (or that does not accept its request format)
+BATCH_UNSUPPORTED = [404, 405, 422]
+
+
+class ModelClientError(Exception):
+    pass
+
+
+"""
+The texts of an issue that are labeled, depending on the "payload-type" field of config.json, as (prefix, text) pairs:
+the prefix is added in front of the label of the text. No text is labeled when the description is needed but missing.
+"""
+def payload_texts(config, title, body):
+    payload_type = config["payload-type"]
+    if payload_type == "title":
+        return [("", title)]
+    if payload_type == "description":
+        return [("", body)] if body is not None else []
+    if payload_type == "merged":
+        return [("", title + (" " + body if body is not None else ""))]
+    if payload_type == "both":
+        return [("title: ", title)] + ([("description: ", body)] if body is not None else [])
+    raise ValueError(f"Unknown payload type: {payload_type}")
+
+
+class ModelClient:
+    def __init__(self, connect_timeout=3.05, read_timeout=30, max_retries=3, retry_backoff=0.5, pool_size=10,
+                 workers=4, label_cache=None):
+        self._label_cache = label_cache
+        self._timeout = (connect_timeout, read_timeout)
+        retry = Retry(total=max_retries, backoff_factor=retry_backoff, status_forcelist=[502, 503, 504],
+                      allowed_methods=["POST"], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers.update({"accept": "application/json", "Content-Type": "application/json"})
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="model-client")
+        self._lock = threading.Lock()
+        self._unbatchable = set()
+        self._stats = {"requests": 0, "errors": 0, "batch_requests": 0, "batch_fallbacks": 0}
+        self._latencies = {"single": deque(maxlen=1000), "batch": deque(maxlen=1000)}
+
+    def _post(self, kind, url, data):
+        start = time.monotonic()
+        try:
+            return self._session.post(url, json=data, timeout=self._timeout)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            MODEL_REQUEST_SECONDS.labels(kind).observe(elapsed)
+            with self._lock:
+                self._stats["requests"] += 1
+                self._latencies[kind].append(elapsed)
+
+    def _cached(self, config, text):
+        if self._label_cache is None:
+            return None
+        return self._label_cache.get(LabelCache.key(config, text))
+
+    def _remember(self, config, text, label):
+        if self._label_cache is not None:
+            self._label_cache.put(LabelCache.key(config, text), label)
+
+    def label(self, config, text):
+        label = self._cached(config, text)
+        if label is not None:
+            return label
+        return self._request_label(config, text)
+
+    def _request_label(self, config, text):
+        response = self._post("single", config["endpoint"], {"text": text})
+        if not response.ok:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise ModelClientError(f"Model endpoint {config['endpoint']} answered {response.status_code}")
+        label = response.json()[config["label-location"]]
+        self._remember(config, text, label)
+        return label
+
+    """
+    Labels the texts with as few round trips as possible, the labels are returned in the order of the texts.
+    """
+    def label_many(self, config, texts):
+        # Only the texts missing from the label cache are sent to the backend
+        labels = [self._cached(config, text) for text in texts]
+        missing = [index for index, label in enumerate(labels) if label is None]
+        if missing:
+            for index, label in zip(missing, self._request_labels(config, [texts[index] for index in missing])):
+                labels[index] = label
+        return labels
+
+    def _request_labels(self, config, texts):
+        endpoint = config["endpoint"]
+        if len(texts) > 1 and endpoint not in self._unbatchable:
+            items = [{"id": str(index), "text": text} for index, text in enumerate(texts)]
+            response = self._post("batch", endpoint.rstrip("/") + "/batch", {"items": items})
+            with self._lock:
+                self._stats["batch_requests"] += 1
+            if response.ok:
+                results = {result["id"]: result for result in response.json()["results"]}
+                errors = [result["error"] for result in results.values() if result.get("error")]
+                if errors:
+                    raise ModelClientError(f"Model endpoint {endpoint} failed: {errors[0]}")
+                labels = [results[item["id"]]["label"] for item in items]
+                for text, label in zip(texts, labels):
+                    self._remember(config, text, label)
+                return labels
+            if response.status_code not in BATCH_UNSUPPORTED:
+                with self._lock:
+                    self._stats["errors"] += 1
+                raise ModelClientError(f"Model endpoint {endpoint}/batch answered {response.status_code}")
+            print(f"Model endpoint {endpoint} does not support batches, sending the texts concurrently", flush=True)
+            with self._lock:
+                self._unbatchable.add(endpoint)
+
+        if len(texts) > 1:
+            with self._lock:
+                self._stats["batch_fallbacks"] += 1
+        return list(self._executor.map(lambda text: self._request_label(config, text), texts))
+
+    def stats(self):
+        with self._lock:
+            latencies = {kind: sorted(values) for kind, values in self._latencies.items()}
+            return {
+                **self._stats,
+                "unbatchable_endpoints": sorted(self._unbatchable),
+                "label_cache": self._label_cache.stats() if self._label_cache is not None else None,
+                "latency_seconds": {
+                    kind: {
+                        "mean": sum(values) / len(values) if values else None,
+                        "p50": values[len(values) // 2] if values else None,
+                        "p95": values[int(len(values) * 0.95)] if values else None,
+                        "max": values[-1] if values else None,
+                    }
+                    for kind, values in latencies.items()
+                },
+            }
@@ -0,0 +1,68 @@
+import sys
+import threading
+
+from collections import Counter
+
+"""
+* Sampling profiler that can be switched on at runtime (see the /debug/profile endpoints of app.py).
+* While a profile is being captured, a background thread samples the Python stack of every other thread at a fixed
+  interval and counts the distinct stacks. Nothing is sampled the rest of the time.
+* Profiles are reported in the collapsed-stack format ("frame;frame;frame count" per line) read by flame graph tools such
+  as flamegraph.pl or speedscope.
+"""
+
+
+class SamplingProfiler:
+    def __init__(self, interval_ms=10.0):
+        self._interval = interval_ms / 1000.0
+        self._lock = threading.Lock()
+        self._samples = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    # Returns False if a profile is already being captured
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._samples = Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self._samples.most_common())
+
+    # Wall-clock profile: threads waiting on I/O (e.g. GitHub API requests) are sampled too
+    def profile(self, seconds):
+        if not self.start():
+            raise RuntimeError("A profile is already being captured")
+        self._stop.wait(seconds)
+        return self.stop()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self._interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._samples[";".join(reversed(stack))] += 1
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+
+from collections import deque
+
+"""
+* Bounded work queue for GitHub webhook events, so that the /webhook handler can reply to GitHub right away instead of
+  doing all the work (token minting, model calls, labeling, emails) within GitHub's delivery timeout.
+* Events of the same repository are processed one at a time and in the order they were received, while events of
+  different repositories are processed concurrently by a fixed number of worker threads.
+* A failing event is retried with exponential backoff when the error is considered transient. Once it is processed,
+  on_success is called with the key the event was submitted with (e.g. its delivery ID), and on_failure when it fails
+  for good.
+"""
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class WebhookQueue:
+    def __init__(self, process_event, workers=4, max_size=1000, max_attempts=3, retry_backoff=2.0,
+                 is_retryable=lambda error: True, on_success=None, on_failure=None):
+        self._process_event = process_event
+        self._workers = workers
+        self._max_size = max_size
+        self._max_attempts = max_attempts
+        self._retry_backoff = retry_backoff
+        self._is_retryable = is_retryable
+        self._on_success = on_success
+        self._on_failure = on_failure
+        self._condition = threading.Condition()
+        # Pending events per repository, and the repositories that have pending events but no worker on them
+        self._pending = {}
+        self._ready = deque()
+        self._busy = set()
+        self._size = 0
+        self._pid = None
+        self._stats = {"enqueued": 0, "rejected": 0, "processed": 0, "failed": 0, "retries": 0}
+        self._latencies = deque(maxlen=1000)
+
+    """
+    The worker threads are started on first use in the current process, since threads do not survive the fork of a
+    pre-loading server (e.g. gunicorn --preload).
+    """
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        for i in range(self._workers):
+            threading.Thread(target=self._work, name=f"webhook-worker-{i}", daemon=True).start()
+
+    def submit(self, repository, *event, key=None):
+        with self._condition:
+            self._ensure_started()
+            if self._size >= self._max_size:
+                self._stats["rejected"] += 1
+                raise QueueFullError(f"Webhook queue is full ({self._max_size} events)")
+            if repository not in self._pending:
+                self._pending[repository] = deque()
+                if repository not in self._busy:
+                    self._ready.append(repository)
+            self._pending[repository].append((time.monotonic(), event, key))
+            self._size += 1
+            self._stats["enqueued"] += 1
+            self._condition.notify()
+
+    def _take(self):
+        with self._condition:
+            while not self._ready:
+                self._condition.wait()
+            repository = self._ready.popleft()
+            events = self._pending[repository]
+            enqueued_at, event, key = events.popleft()
+            if not events:
+                del self._pending[repository]
+            self._busy.add(repository)
+            self._size -= 1
+            return repository, enqueued_at, event, key
+
+    def _release(self, repository):
+        with self._condition:
+            self._busy.discard(repository)
+            # Events received for the repository while it was being processed are now ready
+            if repository in self._pending:
+                self._ready.append(repository)
+                self._condition.notify()
+
+    def _work(self):
+        while True:
+            repository, enqueued_at, event, key = self._take()
+            try:
+                callback = self._on_success if self._run(repository, event) else self._on_failure
+                if callback is not None:
+                    callback(key)
+            except Exception as error:
+                print(f"Handling the result of the event for {repository} failed: {error}", flush=True)
+            finally:
+                with self._condition:
+                    self._latencies.append(time.monotonic() - enqueued_at)
+                self._release(repository)
+
+    def _run(self, repository, event):
+        for attempt in range(1, self._max_attempts + 1):
+            try:
+                self._process_event(*event)
+                with self._condition:
+                    self._stats["processed"] += 1
+                return True
+            except Exception as error:
+                if attempt == self._max_attempts or not self._is_retryable(error):
+                    print(f"Processing event for {repository} failed after {attempt} attempt(s): {error}", flush=True)
+                    with self._condition:
+                        self._stats["failed"] += 1
+                    return False
+                delay = self._retry_backoff * 2 ** (attempt - 1)
+                print(f"Processing event for {repository} failed: {error}, retrying in {delay}s", flush=True)
+                with self._condition:
+                    self._stats["retries"] += 1
+                time.sleep(delay)
+
+    def stats(self):
+        with self._condition:
+            latencies = sorted(self._latencies)
+            return {
+                **self._stats,
+                "queue_depth": self._size,
+                "in_progress": len(self._busy),
+                "latency_seconds": {
+                    "mean": sum(latencies) / len(latencies) if latencies else None,
+                    "p50": latencies[len(latencies) // 2] if latencies else None,
+                    "p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+                    "max": latencies[-1] if latencies else None,
+                },
+            }
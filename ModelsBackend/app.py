@@ -1,9 +1,14 @@
 import json
+import threading
+import time
 import uvicorn
-from typing import Dict, Optional
-from fastapi import FastAPI, HTTPException, Body
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Optional
+from fastapi import FastAPI, HTTPException, Body, Query, Request, Response
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
 from pydantic import BaseModel
-from model import factory, loader
+from model import batching, cache, metrics, profiler, registry
 
 app = FastAPI()
 
@@ -13,18 +18,180 @@ class ModelRequest(BaseModel):
 class ModelResponse(BaseModel):
     label: Optional[str] = None
 
+class ModelResult(ModelResponse):
+    error: Optional[str] = None
+    elapsed_ms: Optional[float] = None
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    text: Optional[str] = None
+
+class BatchModelRequest(BaseModel):
+    items: List[BatchItem]
+    batch_size: Optional[int] = None
+
+class BatchItemResponse(BaseModel):
+    id: Optional[str] = None
+    label: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchModelResponse(BaseModel):
+    results: List[BatchItemResponse]
+
 with open("config.json") as f:
     data = json.load(f)
-    loader.load_plugin(data["plugin"])
 
-    models = {model_data["name"]: factory.create_model(model_data) for model_data in data["models"]}
+    # Requests larger than max_request_bytes are rejected before their body is read (or as soon as it exceeds it), so
+    # that a huge issue body (e.g. pasted logs) cannot stall a worker
+    max_request_bytes = data.get("limits", {}).get("max_request_bytes", 1024 * 1024)
+
+    batch_size = data.get("batch_endpoint", {}).get("batch_size", 64)
+    max_batch_items = data.get("batch_endpoint", {}).get("max_items", 10000)
+
+    # Concurrent requests for the same model are grouped into a single batched call; a model can override the
+    # global "batching" settings with its own "batching" entry
+    batching_settings = {model_data["name"]: {**data.get("batching", {}), **model_data.get("batching", {})}
+                         for model_data in data["models"]}
+    schedulers = {}
+    schedulers_lock = threading.Lock()
+
+    # POST /models labels a text with every model concurrently; a model that fails or exceeds its timeout only fails
+    # its own entry of the response
+    fan_out_settings = data.get("fan_out", {})
+    fan_out_executor = ThreadPoolExecutor(max_workers=fan_out_settings.get("max_workers", max(1, len(data["models"]))),
+                                          thread_name_prefix="fan-out")
+    model_timeouts = {model_data["name"]: model_data.get("timeout_s", fan_out_settings.get("timeout_s", 30))
+                      for model_data in data["models"]}
+
+    # Labels are cached per model version, so replacing the weights file invalidates previous predictions. The version
+    # of a model is computed once, when it is loaded (see on_model_loaded)
+    prediction_cache = None
+    model_data_by_name = {model_data["name"]: model_data for model_data in data["models"]}
+    model_versions = {}
+    if data.get("cache", {}).get("enabled", False):
+        prediction_cache = cache.create_cache(data["cache"])
+
+    # The sampling profiler only samples while a profile is being captured, the endpoints are disabled by default
+    profiler_settings = data.get("profiler", {})
+    sampling_profiler = profiler.SamplingProfiler(profiler_settings.get("interval_ms", 10.0))
+    max_profile_seconds = profiler_settings.get("max_seconds", 60)
+
+
+def on_model_loaded(model_name, model):
+    # Every loaded model reports the time spent in its stages (tokenization, embedding, prediction) to /metrics
+    model.stage_observer = metrics.stage_observer(model_name)
+    # Hashing the weights files here keeps it out of both the startup and the request path
+    if prediction_cache is not None:
+        model_versions[model_name] = cache.model_version(model_data_by_name[model_name], model_data_by_name)
+
+
+# Plugins are imported and models created in the background so that the server accepts connections (and answers
+# /health/live) right away; /health/ready reports when every eager model is loaded and warmed up
+models = registry.ModelRegistry(data, on_model_loaded=on_model_loaded)
+models.start(background=data.get("loading", {}).get("background", True))
+
+print("Configured models:")
+for model_name in models:
+    print(f"  - {model_name} ({'eager' if models[model_name].eager else 'lazy'})")
+
+
+class RequestSizeLimit:
+    """
+    Rejects requests larger than ``max_bytes`` with a 413: right away when their Content-Length says so, otherwise
+    (chunked or understated bodies) as soon as more bytes are received, without reading the rest of the body
+    """
+
+    def __init__(self, app, max_bytes: int) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def too_large(self) -> HTTPException:
+        return HTTPException(status_code=413, detail=f"Request too large, at most {self.max_bytes} bytes are accepted")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse(status_code=413, content={"detail": self.too_large().detail})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised while the endpoint reads the body, FastAPI turns it into the 413 response
+                    raise self.too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(RequestSizeLimit, max_bytes=max_request_bytes)
+
+
+def get_model_object(model_name):
+    try:
+        return models[model_name].get()
+    except registry.ModelNotReadyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+def run_model(model_name, text):
+    model = get_model_object(model_name)
+    if not batching_settings[model_name].get("enabled", False):
+        return model.label(text)
+    if model_name not in schedulers:
+        with schedulers_lock:
+            if model_name not in schedulers:
+                schedulers[model_name] = batching.create_scheduler(model, batching_settings[model_name],
+                                                                   metrics.batch_observer(model_name))
+    return schedulers[model_name].label(text)
+
+
+def model_version(model_name):
+    # Set when the model is loaded, a lazy model is loaded by its first request
+    if model_name not in model_versions:
+        get_model_object(model_name)
+    return model_versions[model_name]
+
+
+def label_text(model_name, text):
+    """Label a text, returning the label and "HIT"/"MISS" (None when the prediction cache is disabled)"""
+    if prediction_cache is None:
+        return run_model(model_name, text), None
+
+    key = cache.PredictionCache.key(model_name, model_version(model_name), text)
+    label = prediction_cache.get(model_name, key)
+    if label is not None:
+        return label, "HIT"
+
+    label = run_model(model_name, text)
+    prediction_cache.put(key, label)
+    return label, "MISS"
+
+
+def timed_label_text(model_name, text):
+    start = time.perf_counter()
+    label, cache_status = label_text(model_name, text)
+    metrics.observe_cache(model_name, cache_status)
+    return label, cache_status, (time.perf_counter() - start) * 1000
+
+
+def set_cache_headers(response, statuses):
+    if prediction_cache is None:
+        return
+    hits = statuses.count("HIT")
+    response.headers["X-Cache-Hits"] = str(hits)
+    response.headers["X-Cache-Misses"] = str(len(statuses) - hits)
 
-print("Loaded models:")
-for model_name, model_object in models.items():
-    print(f"  - {model_name}: {model_object}")
 
 @app.post("/models/{model_name}", response_model=ModelResponse)
-def get_model(model_name: str, data: ModelRequest = Body(...)):
+def get_model(model_name: str, response: Response, data: ModelRequest = Body(...)):
     if model_name not in models:
         raise HTTPException(status_code=404, detail="Model not found")
     
@@ -33,37 +200,159 @@ def get_model(model_name: str, data: ModelRequest = Body(...)):
     if text is None:
         raise HTTPException(status_code=400, detail="Input text not found")
     
-    model = models[model_name]
     label = None
 
     if text is not None:
-        label = model.label(text)
+        with metrics.REQUEST_SECONDS.labels("label", model_name).time():
+            label, cache_status = label_text(model_name, text)
+        metrics.observe_cache(model_name, cache_status)
+        if cache_status is not None:
+            response.headers["X-Cache"] = cache_status
 
     return ModelResponse(label=label)
 
-@app.post("/models", response_model=Dict[str, ModelResponse])
-def get_models(data: ModelRequest = Body(...)):
+@app.post("/models/{model_name}/batch", response_model=BatchModelResponse)
+def get_model_batch(model_name: str, response: Response, data: BatchModelRequest = Body(...)):
+    if model_name not in models:
+        raise HTTPException(status_code=404, detail="Model not found")
+
+    if len(data.items) > max_batch_items:
+        raise HTTPException(status_code=413, detail=f"Too many items, at most {max_batch_items} are accepted")
+
+    with metrics.REQUEST_SECONDS.labels("batch", model_name).time():
+        return label_batch_items(model_name, response, data)
+
+
+def label_batch_items(model_name, response, data):
+    # Items without a text are reported individually instead of failing the whole batch
+    valid = [index for index, item in enumerate(data.items) if item.text is not None]
+    results = [BatchItemResponse(id=item.id, error="Input text not found") for item in data.items]
+
+    # Only the items missing from the prediction cache are sent to the model
+    keys = {}
+    if prediction_cache is not None:
+        statuses = []
+        misses = []
+        for index in valid:
+            keys[index] = cache.PredictionCache.key(model_name, model_version(model_name), data.items[index].text)
+            label = prediction_cache.get(model_name, keys[index])
+            if label is None:
+                statuses.append("MISS")
+                misses.append(index)
+            else:
+                statuses.append("HIT")
+                results[index] = BatchItemResponse(id=data.items[index].id, label=label)
+            metrics.observe_cache(model_name, statuses[-1])
+        valid = misses
+        set_cache_headers(response, statuses)
+
+    labels = batching.label_in_batches(get_model_object(model_name), [data.items[index].text for index in valid],
+                                       data.batch_size or batch_size, metrics.batch_observer(model_name))
+    for index, (label, error) in zip(valid, labels):
+        results[index] = BatchItemResponse(id=data.items[index].id, label=label, error=error)
+        if prediction_cache is not None and error is None:
+            prediction_cache.put(keys[index], label)
+
+    return BatchModelResponse(results=results)
+
+@app.post("/models", response_model=Dict[str, ModelResult])
+def get_models(response: Response, data: ModelRequest = Body(...)):
     text = data.text
 
     if text is None:
         raise HTTPException(status_code=400, detail="Text not found")
 
     results = {}
-    
-    for model_name, model in models.items():
-        label = None
+    statuses = []
 
-        if text is not None:
-            label = model.label(text)
+    start = time.perf_counter()
+    futures = {model_name: fan_out_executor.submit(timed_label_text, model_name, text) for model_name in models}
 
-        results[model_name] = ModelResponse(label=label)
+    for model_name, future in futures.items():
+        # Every model's timeout counts from the moment all models were submitted
+        remaining = model_timeouts[model_name] - (time.perf_counter() - start)
+        try:
+            label, cache_status, elapsed_ms = future.result(timeout=max(0, remaining))
+        except TimeoutError:
+            # A call still waiting for a worker is dropped; a running call cannot be interrupted and finishes in the
+            # background
+            future.cancel()
+            results[model_name] = ModelResult(error=f"Timed out after {model_timeouts[model_name]}s",
+                                              elapsed_ms=(time.perf_counter() - start) * 1000)
+            continue
+        except Exception as e:
+            results[model_name] = ModelResult(error=str(e) or type(e).__name__,
+                                              elapsed_ms=(time.perf_counter() - start) * 1000)
+            continue
 
+        statuses.append(cache_status)
+        results[model_name] = ModelResult(label=label, elapsed_ms=elapsed_ms)
+
+    set_cache_headers(response, statuses)
+    metrics.REQUEST_SECONDS.labels("fan_out", "all").observe(time.perf_counter() - start)
     return results
 
 
 @app.get("/models/names")
 def get_model_names():
-    return list(models.keys())
+    return list(models)
+
+@app.get("/models/{model_name}/stats")
+def get_model_stats(model_name: str):
+    if model_name not in models:
+        raise HTTPException(status_code=404, detail="Model not found")
+
+    handle = models[model_name]
+    stats = {"state": handle.state}
+    if handle.model is not None and hasattr(handle.model, "stats"):
+        stats.update(handle.model.stats())
+    if prediction_cache is not None:
+        stats["prediction_cache"] = prediction_cache.stats(model_name)
+    return stats
+
+@app.get("/metrics")
+def get_metrics():
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
+
+def check_profiler_enabled():
+    if not profiler_settings.get("enabled", False):
+        raise HTTPException(status_code=404, detail="Profiler disabled")
+
+# The profiles only cover the worker process that answers the request
+@app.post("/debug/profile/start")
+def start_profile():
+    check_profiler_enabled()
+    if not sampling_profiler.start():
+        raise HTTPException(status_code=409, detail="A profile is already being captured")
+    return {"status": "started"}
+
+@app.post("/debug/profile/stop")
+def stop_profile():
+    check_profiler_enabled()
+    if not sampling_profiler.running:
+        raise HTTPException(status_code=409, detail="No profile is being captured")
+    return Response(content=sampling_profiler.stop(), media_type="text/plain")
+
+@app.get("/debug/profile")
+def get_profile(seconds: float = Query(10, gt=0)):
+    check_profiler_enabled()
+    if seconds > max_profile_seconds:
+        raise HTTPException(status_code=400, detail=f"A profile lasts at most {max_profile_seconds}s")
+    try:
+        return Response(content=sampling_profiler.profile(seconds), media_type="text/plain")
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/health/live")
+def health_live():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def health_ready(response: Response):
+    if not models.ready():
+        response.status_code = 503
+    return models.report()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
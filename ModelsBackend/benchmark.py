@@ -0,0 +1,292 @@
+"""
+Offline throughput, latency and accuracy benchmark over the bundled SATD datasets
+
+Streams the labeled SATD CSV files through a model configured in config.json (created through the model factory) and
+writes a machine-readable JSON report, so runtimes and cache settings can be compared between releases:
+- single-item latency (p50/p95/p99) and throughput of ``label``
+- batched throughput of ``label_batch`` for each requested batch size
+- accuracy, precision, recall and F1 against the "classification" column (anything but non_debt is SATD)
+- time spent per stage (preprocess, embed, inference, ...) for models reporting their stages
+- peak resident memory
+
+Every pass (single-item, then each batch size) runs on a freshly created model, so that caches warmed by a previous pass
+(embedding cache, ...) do not inflate its throughput. A model wrapping another configured model by name (e.g.
+SATD_Keyword_Cascade) gets its own copy of it, created with it for every pass.
+
+When the model's weight files are absent (or with --stand-in), the SATD detector (the model itself, or the model it
+wraps) is replaced by a tiny randomly initialized stand-in model and embeddings, so the harness runs offline; its
+accuracy is meaningless.
+
+Run from the ModelsBackend directory:
+    python benchmark.py --model Model1_IssueTracker_Li2022_ESEM --output benchmark.json
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from model import batching, factory, loader
+
+DATASETS = [
+    "plugins/satd/satd-dataset-commit_messages.csv",
+    "plugins/satd/satd-dataset-pull_requests.csv",
+]
+SATD_LABEL = "SATD"
+NON_DEBT = "non_debt"
+STAND_IN_TYPE = "Model1_IssueTracker_Li2022_ESEM"
+
+
+def read_rows(datasets, limit=None):
+    """Stream (text, expected label) pairs from the SATD CSV files"""
+    count = 0
+    for dataset in datasets:
+        with open(dataset, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if limit is not None and count >= limit:
+                    return
+                count += 1
+                yield row["text"], "non-SATD" if row["classification"] == NON_DEBT else SATD_LABEL
+
+
+def in_chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def missing_files(parameters):
+    missing = []
+    for key, value in parameters.items():
+        if isinstance(value, dict):
+            missing.extend(missing_files(value.get("parameters", value)))
+        elif key.endswith("_file") and isinstance(value, str) and not os.path.isfile(value):
+            missing.append(value)
+    return missing
+
+
+def inline_wrapped_model(model_data, models_by_name):
+    """The model with the configured model it wraps by name (if any) replaced by that model's description"""
+    wrapped = model_data["parameters"].get("model")
+    if not isinstance(wrapped, str):
+        return model_data
+    if wrapped not in models_by_name:
+        raise ValueError(f"Model {model_data['name']} wraps {wrapped}, which is not configured")
+    return {**model_data, "parameters": {**model_data["parameters"], "model": models_by_name[wrapped]}}
+
+
+def stand_in_model(model_data, stand_in_parameters):
+    """The model with its SATD detector (the model itself, or the model it wraps) replaced by the stand-in"""
+    wrapped = model_data["parameters"].get("model")
+    name = f"{model_data.get('name', model_data['type'])} (stand-in)"
+    if isinstance(wrapped, dict):
+        parameters = {**model_data["parameters"], "model": stand_in_model(wrapped, stand_in_parameters)}
+        return {**model_data, "name": name, "parameters": parameters}
+    parameters = stand_in_parameters
+    # Settings other than files (runtime, cache size, ...) still apply to a stand-in of the same type
+    if model_data["type"] == STAND_IN_TYPE:
+        parameters = {**{key: value for key, value in model_data["parameters"].items()
+                         if not key.endswith("_file") and not key.endswith("_dir")}, **parameters}
+    return {"type": STAND_IN_TYPE, "name": name, "parameters": parameters}
+
+
+def create_model(model_data, stages):
+    """A new instance of the model, reporting its stage timings into stages, and its creation time"""
+    start = time.perf_counter()
+    model = factory.create_model(model_data)
+    load_s = time.perf_counter() - start
+    if hasattr(model, "stage_observer"):
+        model.stage_observer = lambda stage, seconds: stages.__setitem__(stage, stages[stage] + seconds)
+    return model, load_s
+
+
+def create_stand_in(directory, datasets, size_of_input=64, dim=16, bucket=2000, seed=0):
+    """
+    Write a tiny randomly initialized SATD detector (keras weights and memory-mapped embeddings) into directory
+
+    :return: model parameters for the Model1_IssueTracker_Li2022_ESEM type
+    """
+    import numpy as np
+    import tensorflow as tf
+    from plugins.satd.SATD_Detector import shared_embeddings
+
+    rng = np.random.default_rng(seed)
+    words = sorted({word for text, _ in read_rows(datasets, limit=2000) for word in text.lower().split()})
+    embeddings_dir = os.path.join(directory, "shared_embeddings")
+    shared_embeddings.write(embeddings_dir, words, rng.normal(0, 0.1, (len(words) + bucket, dim)), 3, 6, bucket,
+                            {"source": "stand-in"})
+
+    tf.random.set_seed(seed)
+    inputs = tf.keras.Input(shape=(size_of_input, dim))
+    x = tf.keras.layers.Conv1D(8, 3, activation="relu")(inputs)
+    x = tf.keras.layers.GlobalMaxPooling1D()(x)
+    outputs = tf.keras.layers.Dense(2, activation="softmax")(x)
+    weight_file = os.path.join(directory, "weights.h5")
+    tf.keras.Model(inputs, outputs).save(weight_file)
+
+    return {"weight_file": weight_file, "word_embedding_file": os.path.join(directory, "embeddings.bin"),
+            "shared_embeddings_dir": embeddings_dir}
+
+
+def benchmark_single(model, rows):
+    latencies = []
+    start = time.perf_counter()
+    for text, _ in rows:
+        item_start = time.perf_counter()
+        model.label(text)
+        latencies.append((time.perf_counter() - item_start) * 1000)
+    elapsed = time.perf_counter() - start
+    return {
+        "items": len(latencies),
+        "throughput_per_s": len(latencies) / elapsed if elapsed else None,
+        "latency_ms": {
+            "mean": statistics.fmean(latencies) if latencies else None,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+        },
+    }
+
+
+def benchmark_batched(model, rows, batch_size, confusion=None):
+    items = 0
+    start = time.perf_counter()
+    for chunk in in_chunks(rows, batch_size):
+        labels = batching.label_batch(model, [text for text, _ in chunk], batch_size)
+        items += len(chunk)
+        if confusion is not None:
+            for (_, expected), label in zip(chunk, labels):
+                confusion[(expected == SATD_LABEL, label == SATD_LABEL)] += 1
+    elapsed = time.perf_counter() - start
+    return {"items": items, "throughput_per_s": items / elapsed if elapsed else None}
+
+
+def accuracy_report(confusion):
+    tp = confusion[(True, True)]
+    fp = confusion[(False, True)]
+    fn = confusion[(True, False)]
+    tn = confusion[(False, False)]
+    total = tp + fp + fn + tn
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return {
+        "items": total,
+        "accuracy": (tp + tn) / total if total else None,
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "confusion": {"tp": tp, "fp": fp, "fn": fn, "tn": tn},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--model", help="Name of the model in config.json (default: the first model)")
+    parser.add_argument("--dataset", action="append", help="Labeled CSV file (default: bundled SATD CSVs)")
+    parser.add_argument("--limit", type=int, help="Only use the first N rows")
+    parser.add_argument("--single-limit", type=int, default=1000, help="Rows used for the single-item pass")
+    parser.add_argument("--batch-sizes", default="16,64,256", help="Comma-separated batch sizes")
+    parser.add_argument("--stand-in", action="store_true", help="Use a tiny random model even if weights exist")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    # Plugins print their progress; keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(parser, args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+def run(parser, args):
+    with open(args.config) as f:
+        config = json.load(f)
+    model_data = next((entry for entry in config["models"] if args.model in (None, entry["name"])), None)
+    if model_data is None:
+        parser.error(f"Model {args.model} is not configured in {args.config}")
+    datasets = args.dataset or DATASETS
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+
+    loader.load_plugin(config["plugin"])
+    model_data = inline_wrapped_model(model_data, {entry["name"]: entry for entry in config["models"]})
+
+    stand_in_dir = None
+    missing = missing_files(model_data["parameters"])
+    if args.stand_in or missing:
+        if missing and not args.stand_in:
+            print(f"Missing {', '.join(missing)}, using a randomly initialized stand-in model", file=sys.stderr)
+        stand_in_dir = tempfile.TemporaryDirectory()
+        model_data = stand_in_model(model_data, create_stand_in(stand_in_dir.name, datasets))
+
+    stages = defaultdict(float)
+    model, load_s = create_model(model_data, stages)
+
+    report = {
+        "model": model_data["name"],
+        "parameters": model_data["parameters"],
+        "stand_in": stand_in_dir is not None,
+        "datasets": datasets,
+        "python": platform.python_version(),
+        "load_s": load_s,
+        "load_timings": getattr(model, "load_timings", {}),
+    }
+
+    single_limit = args.single_limit if args.limit is None else min(args.single_limit, args.limit)
+    report["single"] = benchmark_single(model, read_rows(datasets, single_limit))
+    report["single"]["stages_s"] = dict(stages)
+    if hasattr(model, "stats"):
+        report["single"]["stats"] = model.stats()
+
+    report["batched"] = {}
+    confusion = defaultdict(int)
+    for index, batch_size in enumerate(batch_sizes):
+        stages.clear()
+        model, _ = create_model(model_data, stages)
+        # Accuracy is measured once, on the first batched pass over all rows
+        result = benchmark_batched(model, read_rows(datasets, args.limit), batch_size,
+                                   confusion if index == 0 else None)
+        result["stages_s"] = dict(stages)
+        if hasattr(model, "stats"):
+            result["stats"] = model.stats()
+        report["batched"][str(batch_size)] = result
+    report["accuracy"] = accuracy_report(confusion)
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    if stand_in_dir is not None:
+        stand_in_dir.cleanup()
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Dynamic micro-batching in front of Model.label"""
+
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5.0
+
+
+class BatchScheduler:
+    """
+    Collects concurrent label requests for a single model and runs them through one batched call.
+
+    A request waits at most ``max_wait_ms`` for other requests to join its batch, and a batch is dispatched as soon
+    as it holds ``max_batch_size`` texts. Models implementing ``label_batch`` are called once per batch, other
+    models fall back to calling ``label`` for each text. A failing batch is retried one text at a time, so that only
+    the requests whose text fails get the error.
+    """
+
+    def __init__(self, model: Any, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms: float = DEFAULT_MAX_WAIT_MS, on_batch: Optional[Callable[[int], None]] = None) -> None:
+        self._model = model
+        self._on_batch = on_batch
+        self._max_batch_size = max(1, int(max_batch_size))
+        self._max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._pending: list[tuple[str, Future]] = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue a text for labeling and return a future resolving to its label"""
+        future: Future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Batch scheduler is closed")
+            self._pending.append((text, future))
+            self._condition.notify()
+        return future
+
+    def label(self, text: str) -> str:
+        """Label a text, blocking until its batch has been processed"""
+        return self.submit(text).result()
+
+    def close(self) -> None:
+        """Stop accepting requests; pending requests are still processed"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._worker.join()
+
+    def _next_batch(self) -> list[tuple[str, Future]]:
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if not self._pending:
+                return []
+            # The window opens when the first request of the batch arrives
+            deadline = time.monotonic() + self._max_wait
+            while len(self._pending) < self._max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[:self._max_batch_size]
+            del self._pending[:self._max_batch_size]
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            texts = [text for text, _ in batch]
+            try:
+                labels = self._label_batch(texts)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                # Like label_in_batches: a single bad text only fails its own request
+                for text, future in batch:
+                    try:
+                        future.set_result(self._model.label(text))
+                    except Exception as error:
+                        future.set_exception(error)
+                continue
+            for (_, future), label in zip(batch, labels):
+                future.set_result(label)
+
+    def _label_batch(self, texts: list[str]) -> list[str]:
+        if self._on_batch is not None:
+            self._on_batch(len(texts))
+        if len(texts) > 1:
+            return label_batch(self._model, texts, len(texts))
+        return [self._model.label(texts[0])]
+
+
+def label_batch(model: Any, texts: list[str], batch_size: int) -> list[str]:
+    """
+    Label texts with the model's own batch method, or one at a time if it does not implement one. A batch method
+    returning more or fewer labels than texts raises, instead of silently pairing texts with the wrong labels.
+    """
+    if not hasattr(model, "label_batch"):
+        return [model.label(text) for text in texts]
+    labels = list(model.label_batch(texts, batch_size))
+    if len(labels) != len(texts):
+        raise ValueError(f"Model returned {len(labels)} labels for a batch of {len(texts)} texts")
+    return labels
+
+
+def label_in_batches(model: Any, texts: list[str], batch_size: int,
+                     on_batch: Optional[Callable[[int], None]] = None) -> list[tuple[Optional[str], Optional[str]]]:
+    """
+    Label texts in chunks of ``batch_size``, returning a (label, error) pair per text.
+
+    A failing chunk is retried one text at a time so that a single bad input only fails its own item. ``on_batch`` is
+    called with the size of every chunk.
+    """
+    batch_size = max(1, int(batch_size))
+    results: list[tuple[Optional[str], Optional[str]]] = []
+    for start in range(0, len(texts), batch_size):
+        chunk = texts[start:start + batch_size]
+        if on_batch is not None:
+            on_batch(len(chunk))
+        try:
+            results.extend((label, None) for label in label_batch(model, chunk, batch_size))
+            continue
+        except Exception:
+            pass
+        for text in chunk:
+            try:
+                results.append((model.label(text), None))
+            except Exception as e:
+                results.append((None, str(e) or type(e).__name__))
+    return results
+
+
+def create_scheduler(model: Any, settings: dict[str, Any],
+                     on_batch: Optional[Callable[[int], None]] = None) -> BatchScheduler:
+    """Create a batch scheduler from the "batching" section of config.json"""
+    return BatchScheduler(
+        model,
+        max_batch_size=settings.get("max_batch_size", DEFAULT_MAX_BATCH_SIZE),
+        max_wait_ms=settings.get("max_wait_ms", DEFAULT_MAX_WAIT_MS),
+        on_batch=on_batch,
+    )
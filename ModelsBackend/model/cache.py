@@ -0,0 +1,147 @@
+"""Content-addressed prediction cache"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict, defaultdict
+from typing import Any, Optional
+
+DEFAULT_MAX_ENTRIES = 10000
+MAX_HASHED_FILE_SIZE = 256 * 1024 * 1024
+
+
+def normalize_text(text: str) -> str:
+    """Normalization applied before hashing; it must never change the label a model would produce"""
+    return unicodedata.normalize("NFC", text).strip()
+
+
+def file_digest(path: str) -> str:
+    """
+    SHA-256 of a file, used to tie cached predictions to the weights that produced them. Files larger than
+    ``MAX_HASHED_FILE_SIZE`` (multi-GB embeddings) are fingerprinted by size and modification time instead.
+    """
+    stat = os.stat(path)
+    if stat.st_size > MAX_HASHED_FILE_SIZE:
+        return hashlib.sha256(f"{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parameter_files(parameters: dict[str, Any]) -> list[str]:
+    """Existing files referenced by "*_file" parameters, including those of nested (wrapped) models"""
+    files = []
+    for key in sorted(parameters):
+        value = parameters[key]
+        if isinstance(value, dict):
+            files.extend(_parameter_files(value.get("parameters", value)))
+        elif key.endswith("_file") and isinstance(value, str) and os.path.isfile(value):
+            files.append(value)
+    return files
+
+
+def model_version(model_data: dict[str, Any], models: Optional[dict[str, dict[str, Any]]] = None) -> str:
+    """
+    Version of a configured model: its explicit "version" entry, otherwise the hash of its weights (and embeddings)
+    files, otherwise its parameters. A model wrapping another configured model by name (``models`` maps the names to
+    their config entries) also changes version with it.
+    """
+    parameters = model_data.get("parameters", {})
+    if "version" in model_data:
+        version = str(model_data["version"])
+    else:
+        files = _parameter_files(parameters)
+        if files:
+            version = "-".join(file_digest(path)[:16] for path in files)
+        else:
+            version = hashlib.sha256(repr(sorted(parameters.items())).encode("utf-8")).hexdigest()[:16]
+    wrapped = parameters.get("model")
+    if isinstance(wrapped, str) and models is not None and wrapped in models and wrapped != model_data.get("name"):
+        version += "+" + model_version(models[wrapped], models)
+    return version
+
+
+class PredictionCache:
+    """
+    LRU cache of labels keyed by (model name, model version, hash of the normalized text), with an optional sqlite
+    tier that survives restarts
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, path: Optional[str] = None) -> None:
+        self._max_entries = max(1, int(max_entries))
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits: dict[str, int] = defaultdict(int)
+        self._misses: dict[str, int] = defaultdict(int)
+        # In-memory entries per model name
+        self._model_entries: dict[str, int] = defaultdict(int)
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, label TEXT NOT NULL)")
+            self._db.commit()
+
+    @staticmethod
+    def key(model_name: str, version: str, text: str) -> str:
+        text_hash = hashlib.sha256(normalize_text(text).encode("utf-8", "surrogatepass")).hexdigest()
+        return f"{model_name}:{version}:{text_hash}"
+
+    def get(self, model_name: str, key: str) -> Optional[str]:
+        with self._lock:
+            label = self._entries.get(key)
+            if label is not None:
+                self._entries.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute("SELECT label FROM predictions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    label = row[0]
+                    self._remember(key, label)
+            if label is None:
+                self._misses[model_name] += 1
+            else:
+                self._hits[model_name] += 1
+            return label
+
+    def put(self, key: str, label: str) -> None:
+        with self._lock:
+            self._remember(key, label)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO predictions (key, label) VALUES (?, ?)", (key, label))
+                self._db.commit()
+
+    @staticmethod
+    def _model_name(key: str) -> str:
+        return key.rsplit(":", 2)[0]
+
+    def _remember(self, key: str, label: str) -> None:
+        if key not in self._entries:
+            self._model_entries[self._model_name(key)] += 1
+        self._entries[key] = label
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            self._model_entries[self._model_name(evicted)] -= 1
+
+    def stats(self, model_name: str) -> dict[str, Any]:
+        with self._lock:
+            hits = self._hits[model_name]
+            misses = self._misses[model_name]
+            return {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "entries": self._model_entries[model_name],
+                # Shared by all the models
+                "total_entries": len(self._entries),
+                "max_entries": self._max_entries,
+                "persistent": self._db is not None,
+            }
+
+
+def create_cache(settings: dict[str, Any]) -> PredictionCache:
+    """Create the prediction cache from the "cache" section of config.json"""
+    return PredictionCache(max_entries=settings.get("max_entries", DEFAULT_MAX_ENTRIES), path=settings.get("path"))
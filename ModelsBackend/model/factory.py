@@ -1,14 +1,21 @@
 from model.model import Model
-from typing import Callable, Any
+from typing import Callable, Any, Optional
 
 model_creation_funcs: dict[str, Callable[..., Model]] = {}
 
+# Set by the model registry, so that a model can wrap another configured model by name instead of creating its own copy
+model_resolver: Optional[Callable[[str], Model]] = None
+
 def register_model(model_type: str, func: Callable[..., Model]) -> None:
     model_creation_funcs[model_type] = func
 
 def unregister_model(model_type: str) -> None:
     model_creation_funcs.pop(model_type, None)
 
+def set_model_resolver(resolver: Optional[Callable[[str], Model]]) -> None:
+    global model_resolver
+    model_resolver = resolver
+
 def create_model(arguments: dict[str, Any]) -> Model:
     args_copy = arguments.copy()
     model_type = args_copy.pop("type")
@@ -17,4 +24,10 @@ def create_model(arguments: dict[str, Any]) -> Model:
         creation_func = model_creation_funcs[model_type]
         return creation_func(**model_params)
     except KeyError:
-        raise ValueError(f"Unknown model type: {model_type}") from None
\ No newline at end of file
+        raise ValueError(f"Unknown model type: {model_type}") from None
+
+def get_model(name: str) -> Model:
+    """The configured model with this name, loaded by the registry if needed"""
+    if model_resolver is None:
+        raise ValueError(f"Cannot resolve model {name}: no model registry")
+    return model_resolver(name)
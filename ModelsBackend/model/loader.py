@@ -1,6 +1,7 @@
 """Simple plugin loader"""
 
 import importlib
+import time
 
 class PluginLoader:
     """Plugin loader class"""
@@ -12,8 +13,12 @@ class PluginLoader:
 def import_module(module_name: str) -> PluginLoader:
     return importlib.import_module(module_name) # type: ignore
 
-def load_plugin(plugin_name: list[str]) -> None:
-    """Load plugin"""
+def load_plugin(plugin_name: list[str]) -> dict[str, float]:
+    """Load plugin, returning the time in seconds spent importing and initializing each plugin"""
+    timings = {}
     for plugin in plugin_name:
+        start = time.perf_counter()
         plugin_module = import_module(plugin)
         plugin_module.initialize()
+        timings[plugin] = time.perf_counter() - start
+    return timings
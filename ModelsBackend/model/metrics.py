@@ -0,0 +1,48 @@
+"""
+Prometheus metrics of the model backend
+
+With several uvicorn workers, every worker writes its samples to ``PROMETHEUS_MULTIPROC_DIR`` (set in the Dockerfile)
+and ``/metrics`` aggregates the files of all workers, so a scrape reports the whole server whichever worker answers it.
+"""
+
+import os
+from typing import Any, Callable
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+REQUEST_SECONDS = Histogram("model_request_seconds", "End-to-end latency of the labeling endpoints",
+                            ["endpoint", "model"], buckets=LATENCY_BUCKETS)
+STAGE_SECONDS = Histogram("model_stage_seconds",
+                          "Time spent per model stage (preprocess: tokenization, embed, inference: prediction, "
+                          "keywords)", ["model", "stage"], buckets=LATENCY_BUCKETS)
+BATCH_SIZE = Histogram("model_batch_size", "Number of texts per batched model call", ["model"],
+                       buckets=BATCH_SIZE_BUCKETS)
+CACHE_REQUESTS = Counter("model_prediction_cache_requests", "Prediction cache lookups", ["model", "result"])
+
+
+def stage_observer(model_name: str) -> Callable[[str, float], None]:
+    """A ``stage_observer`` for a model, recording its stage timings"""
+    return lambda stage, seconds: STAGE_SECONDS.labels(model_name, stage).observe(seconds)
+
+
+def batch_observer(model_name: str) -> Callable[[int], None]:
+    return lambda size: BATCH_SIZE.labels(model_name).observe(size)
+
+
+def observe_cache(model_name: str, status: Any) -> None:
+    """Count a prediction cache lookup ("HIT"/"MISS", None when the cache is disabled)"""
+    if status is not None:
+        CACHE_REQUESTS.labels(model_name, status.lower()).inc()
+
+
+def render() -> tuple[bytes, str]:
+    """Metrics in the Prometheus text format, and their content type"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
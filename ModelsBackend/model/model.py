@@ -7,4 +7,16 @@ class Model(Protocol):
     def label(self, issue):
         """Labels an issue"""
 
-    
\ No newline at end of file
+    def label_batch(self, issues, batch_size):
+        """
+        Labels a list of issues, returning the labels in the same order.
+
+        Optional: models that do not implement it are labeled one issue at a time.
+        """
+
+    def stats(self):
+        """
+        Runtime statistics of the model (caches, memory), exposed by the backend.
+
+        Optional: models that do not implement it report no statistics.
+        """
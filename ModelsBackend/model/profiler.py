@@ -0,0 +1,70 @@
+"""
+Sampling profiler that can be switched on at runtime
+
+While running, a background thread samples the Python stack of every other thread at a fixed interval and counts the
+distinct stacks. The profile is reported in the collapsed-stack format (``frame;frame;frame count`` per line) read by
+flame graph tools such as flamegraph.pl or speedscope. Sampling only costs anything while a profile is being captured.
+"""
+
+import sys
+import threading
+from collections import Counter
+from typing import Optional
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval_ms: float = 10.0) -> None:
+        self._interval = interval_ms / 1000.0
+        self._lock = threading.Lock()
+        self._samples: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> bool:
+        """Start sampling; returns False if a profile is already being captured"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._samples = Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> str:
+        """Stop sampling and return the collapsed stacks"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self._samples.most_common())
+
+    def profile(self, seconds: float) -> str:
+        """Capture a profile for ``seconds`` (wall-clock time: waiting threads are sampled too)"""
+        if not self.start():
+            raise RuntimeError("A profile is already being captured")
+        self._stop.wait(seconds)
+        return self.stop()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self._interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._samples[";".join(reversed(stack))] += 1
@@ -0,0 +1,165 @@
+"""Model registry with lazy/eager/background loading and readiness tracking"""
+
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from model import factory, loader
+from model.model import Model
+
+WARM_UP_TEXT = "This is a warm-up request."
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class ModelNotReadyError(Exception):
+    """Raised when a model failed to load"""
+
+
+class ModelHandle:
+    """
+    A configured model that is created on demand.
+
+    ``"load": "eager"`` models are created at startup (in the background by default), ``"load": "lazy"`` models on
+    their first request. Creating a model runs one warm-up inference so that the first real request does not pay for
+    tracing, lazy initialization or cold caches.
+    """
+
+    def __init__(self, model_data: dict[str, Any], plugins_loaded: threading.Event,
+                 on_loaded: Optional[Callable[[str, Model], None]] = None) -> None:
+        self.name = model_data["name"]
+        self.eager = model_data.get("load", "eager") == "eager"
+        self._model_data = model_data
+        self._plugins_loaded = plugins_loaded
+        self._on_loaded = on_loaded
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._loading_thread: Optional[int] = None
+        self.state = PENDING
+        self.error: Optional[str] = None
+        self.model: Optional[Model] = None
+        self.timings: dict[str, float] = {}
+
+    def load(self) -> None:
+        """Create and warm up the model; concurrent callers wait for the first one"""
+        with self._lock:
+            if self.state != PENDING:
+                return
+            self.state = LOADING
+            self._loading_thread = threading.get_ident()
+        try:
+            self._plugins_loaded.wait()
+            start = time.perf_counter()
+            model = factory.create_model(self._model_data)
+            self.timings["create_s"] = time.perf_counter() - start
+            # Plugins may break the creation time down further (weights, embeddings, ...)
+            self.timings.update(getattr(model, "load_timings", {}))
+            if self._model_data.get("warm_up", True):
+                start = time.perf_counter()
+                model.label(self._model_data.get("warm_up_text", WARM_UP_TEXT))
+                self.timings["warm_up_s"] = time.perf_counter() - start
+            # Called before the model serves requests, e.g. to attach metrics observers
+            if self._on_loaded is not None:
+                self._on_loaded(self.name, model)
+            self.model = model
+            self.state = READY
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = FAILED
+            print(f"Failed to load model {self.name}: {self.error}", flush=True)
+        finally:
+            self._done.set()
+
+    def get(self) -> Model:
+        """Return the model, loading it first if needed"""
+        if self.state == PENDING:
+            self.load()
+        if self._loading_thread == threading.get_ident() and not self._done.is_set():
+            # A model wrapping itself (directly or through other models) would wait for its own loading forever
+            raise ModelNotReadyError(f"Model {self.name} depends on itself")
+        self._done.wait()
+        if self.model is None:
+            raise ModelNotReadyError(f"Model {self.name} failed to load: {self.error}")
+        return self.model
+
+
+class ModelRegistry:
+
+    def __init__(self, config: dict[str, Any], on_model_loaded: Optional[Callable[[str, Model], None]] = None) -> None:
+        self._plugins = config["plugin"]
+        self._plugins_loaded = threading.Event()
+        self.plugin_timings: dict[str, float] = {}
+        self.plugin_error: Optional[str] = None
+        self.handles = {model_data["name"]: ModelHandle(model_data, self._plugins_loaded, on_model_loaded)
+                        for model_data in config["models"]}
+        # Models wrapping another configured model (e.g. a keyword cascade) share its instance through the registry
+        factory.set_model_resolver(self._resolve)
+        self._started = time.perf_counter()
+        self.startup_s: Optional[float] = None
+
+    def __contains__(self, model_name: str) -> bool:
+        return model_name in self.handles
+
+    def __getitem__(self, model_name: str) -> ModelHandle:
+        return self.handles[model_name]
+
+    def __iter__(self):
+        return iter(self.handles)
+
+    def __len__(self) -> int:
+        return len(self.handles)
+
+    def _resolve(self, model_name: str) -> Model:
+        if model_name not in self.handles:
+            raise ValueError(f"Unknown model: {model_name}")
+        return self.handles[model_name].get()
+
+    def start(self, background: bool = True) -> None:
+        """Import the plugins and create the eager models, in a background thread unless told otherwise"""
+        if background:
+            threading.Thread(target=self._load, name="model-loader", daemon=True).start()
+        else:
+            self._load()
+
+    def _load(self) -> None:
+        try:
+            self.plugin_timings = loader.load_plugin(self._plugins)
+        except Exception as e:
+            self.plugin_error = f"{type(e).__name__}: {e}"
+            print(f"Failed to load plugins: {self.plugin_error}", flush=True)
+            return
+        finally:
+            # Lazy models waiting for the plugins fail on their own instead of hanging when the import failed
+            self._plugins_loaded.set()
+        for handle in self.handles.values():
+            if handle.eager:
+                handle.load()
+        self.startup_s = time.perf_counter() - self._started
+        print(self.format_report(), flush=True)
+
+    def ready(self) -> bool:
+        """Ready once the plugins are imported and every eager model is loaded"""
+        return (self._plugins_loaded.is_set() and self.plugin_error is None
+                and all(handle.state == READY for handle in self.handles.values() if handle.eager))
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "ready": self.ready(),
+            "startup_s": self.startup_s,
+            "plugins": {"import_s": self.plugin_timings, "error": self.plugin_error},
+            "models": {name: {"state": handle.state, "load": "eager" if handle.eager else "lazy",
+                              "error": handle.error, "timings": handle.timings}
+                       for name, handle in self.handles.items()},
+        }
+
+    def format_report(self) -> str:
+        lines = ["Startup timings:"]
+        for plugin, seconds in self.plugin_timings.items():
+            lines.append(f"  - import {plugin}: {seconds:.2f}s")
+        for name, handle in self.handles.items():
+            timings = ", ".join(f"{key} {value:.2f}s" for key, value in handle.timings.items())
+            lines.append(f"  - {name} ({handle.state}): {timings or 'not loaded'}")
+        return "\n".join(lines)
@@ -0,0 +1,99 @@
+"""
+Bounded word-embedding store for the SATD detector
+
+Word vectors are kept in one contiguous float32 matrix indexed through a token -> row mapping, so the input tensor of a
+request is built with a single fancy-index gather. Row 0 holds the padding vector and is never evicted; the other rows
+are recycled in least-recently-used order once the store is full.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+PADDING_ROW = 0
+
+
+class EmbeddingStore:
+
+    def __init__(self, word_embedding, padding, capacity, initial_rows=1024):
+        """
+        :param word_embedding: fastText model (or any token -> vector mapping) used on cache misses
+        :param padding: padding token, its vector is precomputed in row 0
+        :param capacity: maximum number of cached (non-padding) tokens
+        """
+        self._word_embedding = word_embedding
+        self._capacity = max(1, int(capacity))
+        padding_vector = np.asarray(word_embedding[padding], dtype=np.float32)
+        self._dim = padding_vector.shape[0]
+        # The matrix grows by doubling until it holds capacity + 1 rows
+        self._matrix = np.empty((min(self._capacity, initial_rows) + 1, self._dim), dtype=np.float32)
+        self._matrix[PADDING_ROW] = padding_vector
+        self._rows = OrderedDict()
+        self._free_row = PADDING_ROW + 1
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def dim(self):
+        return self._dim
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def _row(self, token):
+        row = self._rows.get(token)
+        if row is not None:
+            self._rows.move_to_end(token)
+            self._hits += 1
+            return row
+        self._misses += 1
+        if self._free_row <= self._capacity:
+            row = self._free_row
+            self._free_row += 1
+            if row >= len(self._matrix):
+                grown = np.empty((min(2 * (len(self._matrix) - 1), self._capacity) + 1, self._dim), dtype=np.float32)
+                grown[:len(self._matrix)] = self._matrix
+                self._matrix = grown
+        else:
+            _, row = self._rows.popitem(last=False)
+            self._evictions += 1
+        self._matrix[row] = self._word_embedding[token]
+        self._rows[token] = row
+        return row
+
+    def gather(self, tokens, length):
+        """
+        Build the (len(tokens), length, dim) input tensor for lists of tokens, truncating or padding each to length
+
+        :param tokens: list of token lists
+        :param length: number of tokens per row of the input tensor
+        :return:
+        """
+        input_x = np.empty((len(tokens), length, self._dim), dtype=np.float32)
+        indices = np.full(length, PADDING_ROW, dtype=np.intp)
+        with self._lock:
+            for i, sentence in enumerate(tokens):
+                # Rows are gathered sentence by sentence: a later sentence of the batch may recycle the rows of an
+                # earlier one, but never its own as long as the capacity is not smaller than the sentence length
+                indices[:] = PADDING_ROW
+                indices[:min(len(sentence), length)] = [self._row(token) for token in sentence[:length]]
+                np.take(self._matrix, indices, axis=0, out=input_x[i])
+        return input_x
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._rows),
+                "capacity": self._capacity,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "used_bytes": (len(self._rows) + 1) * self._dim * self._matrix.itemsize,
+                "allocated_bytes": self._matrix.nbytes,
+            }
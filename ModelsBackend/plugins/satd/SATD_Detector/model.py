@@ -1,12 +1,20 @@
 import argparse
 import re
 import string
+import time
 
 import fasttext
 import nltk
 import numpy as np
 import tensorflow as tf
 from model import factory
+from plugins.satd.SATD_Detector.embedding_store import EmbeddingStore
+from plugins.satd.SATD_Detector.runtime import create_runtime
+from plugins.satd.SATD_Detector.shared_embeddings import SharedEmbeddings, ensure_exported
+
+COMMENT_DELIMITERS = re.compile('(//)|(/\\*)|(\\*/)')
+# Length of the first prefix of a comment tokenized in incremental mode, doubled until it yields enough tokens
+INCREMENTAL_PREFIX_CHARS = 4096
 
 
 class Model1_IssueTracker_Li2022_ESEM:
@@ -16,66 +24,133 @@ class Model1_IssueTracker_Li2022_ESEM:
 
     name:str
 
-    def __init__(self, weight_file, word_embedding_file):
+    def __init__(self, weight_file, word_embedding_file, runtime="predict", jit_compile=False, warm_up=True,
+                 embedding_cache_size=50000, shared_embeddings_dir=None, incremental_tokenization=True):
+        # Time spent in each loading stage, reported by the backend at startup
+        self.load_timings = {}
+        # Optional callable(stage, seconds) notified after the "preprocess", "embed" and "inference" stages
+        self.stage_observer = None
+
         # Load the model and its weights
         print('Loading model {}...'.format(weight_file))
+        start = time.perf_counter()
         self._model = tf.keras.models.load_model(weight_file)
         self._model.trainable = False
         self._size_of_input = self._model.layers[0].get_output_at(0).get_shape()[1]
-
-        # Load the FastText word embeddings
-        self._word_embedding = fasttext.load_model(word_embedding_file)
-        self._word_embedding_cache = {}
-
-        # Initialize the tokenizer and punctuation settings
-        self._tokenizer_words = nltk.TweetTokenizer()
+        self.load_timings['weights_s'] = time.perf_counter() - start
 
         # Set up label configurations
         label_num = self._model.layers[-1].get_output_at(0).get_shape()[-1]
         self._labels = ['SATD', 'non-SATD']
         self._padding = '<pad>'
 
-    def comment_pre_processing(self, comment):
+        # Load the FastText word embeddings, looked up through a bounded LRU store that always fits one full input.
+        # With a shared embeddings directory, the embeddings are exported once and memory-mapped by every worker.
+        start = time.perf_counter()
+        if shared_embeddings_dir is not None:
+            ensure_exported(word_embedding_file, shared_embeddings_dir)
+            self._word_embedding = SharedEmbeddings(shared_embeddings_dir)
+        else:
+            self._word_embedding = fasttext.load_model(word_embedding_file)
+        self.load_timings['embeddings_s'] = time.perf_counter() - start
+        self._word_embedding_cache = EmbeddingStore(self._word_embedding, self._padding,
+                                                    max(embedding_cache_size, self._size_of_input))
+
+        # Initialize the tokenizers (the sentence tokenizer used by nltk.sent_tokenize, loaded once) and punctuation
+        # settings. In incremental mode, only the beginning of a comment that yields the tokens used by the model is
+        # tokenized.
+        self._tokenizer_sentences = nltk.data.load('tokenizers/punkt/english.pickle')
+        self._tokenizer_words = nltk.TweetTokenizer()
+        self._incremental_tokenization = incremental_tokenization
+
+        # Select the inference runtime and pay its tracing/conversion cost before the first request
+        print('Using {} inference runtime'.format(runtime))
+        start = time.perf_counter()
+        self._runtime = self.build_runtime(runtime, jit_compile)
+        if warm_up:
+            self._runtime(self.prepare_comments(''))
+        self.load_timings['runtime_s'] = time.perf_counter() - start
+
+    def build_runtime(self, runtime, jit_compile=False):
+        """
+        Build an inference runtime for the loaded model
+
+        :param runtime: "predict", "function" or "tflite"
+        :return:
+        """
+        return create_runtime(runtime, self._model, self._size_of_input, self._word_embedding.get_dimension(),
+                              jit_compile)
+
+    def comment_pre_processing(self, comment, max_tokens=None):
         """
         Pre-process comment
 
+        In incremental mode and with max_tokens, growing prefixes of the comment are tokenized until their complete
+        sentences yield max_tokens tokens. The prefixes end at a space, so that no word or comment delimiter is cut, and
+        their last sentence, which may continue after the prefix, is left out: the tokens returned then start with the
+        same max_tokens tokens as those of the whole comment.
+
         :param comment:
+        :param max_tokens: number of leading tokens that are used
         :return:
         """
-        # Remove comment delimiters and convert to lowercase
-        comment = re.sub('(//)|(/\\*)|(\\*/)', '', comment)
-        comment = comment.replace('\ud83d', '').lower()
+        length = INCREMENTAL_PREFIX_CHARS
+        while self._incremental_tokenization and max_tokens is not None and length < len(comment):
+            end = comment.rfind(' ', 0, length)
+            if end > 0:
+                sentences = self._tokenize_sentences(comment[:end])[:-1]
+                tokens = [word for t in sentences for word in self._tokenizer_words.tokenize(t)]
+                if len(tokens) >= max_tokens:
+                    return tokens
+            length *= 2
+
         # Tokenize comment into sentences and words
-        tokens_sentences = [self._tokenizer_words.tokenize(t) for t in nltk.sent_tokenize(comment)]
+        tokens_sentences = [self._tokenizer_words.tokenize(t) for t in self._tokenize_sentences(comment)]
         tokens = [word for t in tokens_sentences for word in t]
         return tokens
 
+    def _tokenize_sentences(self, comment):
+        # Remove comment delimiters and convert to lowercase
+        comment = COMMENT_DELIMITERS.sub('', comment)
+        comment = comment.replace('\ud83d', '').lower()
+        return self._tokenizer_sentences.tokenize(comment)
+
     def prepare_comments(self, comment):
         """
         Prepare comments for machine learning model
 
         :return:
         """
-        # Pre-process the comment
-        pre_stripped = self.comment_pre_processing(comment)
+        return self.prepare_comments_in_batch([comment])
 
-        # Pad or truncate the comment based on the input size
-        if len(pre_stripped) > self._size_of_input:
-            new_sentence = pre_stripped[:self._size_of_input]
-        else:
-            num_padding = self._size_of_input - len(pre_stripped)
-            new_sentence = pre_stripped + [self._padding] * num_padding
-
-        # Convert words to word embeddings
-        x_test = []
-        for word in new_sentence:
-            if word not in self._word_embedding_cache:
-                word_embed = self._word_embedding[word]
-                self._word_embedding_cache[word] = word_embed
-                x_test.append(word_embed)
-            else:
-                x_test.append(self._word_embedding_cache[word])
-        return np.array([x_test])
+    def prepare_comments_in_batch(self, comments):
+        """
+        Prepare a list of comments for machine learning model
+
+        :return:
+        """
+        # Pre-process the comments
+        start = time.perf_counter()
+        pre_stripped = [self.comment_pre_processing(comment, self._size_of_input) for comment in comments]
+        self._observe_stage('preprocess', start)
+
+        # Truncate or pad (with the precomputed padding row) the comments and convert words to word embeddings
+        start = time.perf_counter()
+        input_x = self._word_embedding_cache.gather(pre_stripped, self._size_of_input)
+        self._observe_stage('embed', start)
+        return input_x
+
+    def _observe_stage(self, stage, start):
+        if self.stage_observer is not None:
+            self.stage_observer(stage, time.perf_counter() - start)
+
+    def stats(self):
+        """
+        Runtime statistics, e.g. hit rate and memory usage of the word embedding store
+
+        :return:
+        """
+        return {"embeddings": self._word_embedding_cache.stats()}
 
     def clear_model_session(self):
         tf.keras.backend.clear_session()
@@ -90,7 +165,9 @@ class Model1_IssueTracker_Li2022_ESEM:
         input_x = self.prepare_comments(comment)
 
         # Make predictions using the model
-        y_pred = self._model.predict(input_x)
+        start = time.perf_counter()
+        y_pred = self._runtime(input_x)
+        self._observe_stage('inference', start)
         y_pred_bool = np.argmax(y_pred, axis=1)
 
         # Print the prediction results
@@ -103,14 +180,25 @@ class Model1_IssueTracker_Li2022_ESEM:
         :param comment:
         """
         # Prepare the comment for classification
-        input_x = np.concatenate([self.prepare_comments(x) for x in comments])
+        input_x = self.prepare_comments_in_batch(comments)
 
         # Make predictions using the model
-        y_pred = self._model.predict(input_x, batch_size=batch_size, verbose=1)
+        start = time.perf_counter()
+        y_pred = self._runtime(input_x, batch_size=batch_size)
+        self._observe_stage('inference', start)
         y_pred_ints = np.argmax(y_pred, axis=1)
 
         # Print the prediction results
         return [self._labels[y] for y in y_pred_ints]
-    
+
+    def label_batch(self, comments, batch_size):
+        """
+        Classify a list of comments, batched for the model backend
+
+        :param comments:
+        :param batch_size:
+        """
+        return self.label_sections_in_batch(comments, batch_size)
+
 def initialize() -> None:
     factory.register_model("Model1_IssueTracker_Li2022_ESEM", Model1_IssueTracker_Li2022_ESEM)
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""
+Inference runtimes for the SATD detector
+
+Each runtime wraps the loaded keras model into a callable mapping an input batch of word embeddings
+(shape: batch x size_of_input x embedding_dim) to the model's output probabilities.
+"""
+
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+RUNTIMES = ("predict", "function", "tflite")
+
+
+def _in_chunks(run, input_x, batch_size):
+    """Run ``run`` over slices of at most ``batch_size`` rows, like ``predict`` does"""
+    if not batch_size or len(input_x) <= batch_size:
+        return run(input_x)
+    return np.concatenate([run(input_x[start:start + batch_size]) for start in range(0, len(input_x), batch_size)])
+
+
+class PredictRuntime:
+    """Reference runtime: plain keras ``Model.predict``"""
+
+    def __init__(self, model):
+        self._model = model
+
+    def __call__(self, input_x, batch_size=None):
+        return self._model.predict(input_x, batch_size=batch_size, verbose=0)
+
+
+class FunctionRuntime:
+    """
+    ``tf.function`` traced once with a fixed input signature, skipping the data adapter and callbacks that keras
+    sets up on every ``predict`` call
+    """
+
+    def __init__(self, model, size_of_input, embedding_dim, jit_compile=False):
+        signature = [tf.TensorSpec(shape=[None, size_of_input, embedding_dim], dtype=tf.float32)]
+        self._function = tf.function(lambda x: model(x, training=False), input_signature=signature,
+                                     jit_compile=jit_compile)
+
+    def __call__(self, input_x, batch_size=None):
+        return _in_chunks(self._run, input_x, batch_size)
+
+    def _run(self, input_x):
+        return self._function(tf.convert_to_tensor(input_x, dtype=tf.float32)).numpy()
+
+
+class TFLiteRuntime:
+    """TFLite-converted interpreter; the interpreter is not thread-safe, so calls are serialized"""
+
+    def __init__(self, model, size_of_input, embedding_dim):
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        # Recurrent layers may need TF ops that have no TFLite builtin equivalent
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+        self._interpreter = tf.lite.Interpreter(model_content=converter.convert())
+        self._input_index = self._interpreter.get_input_details()[0]["index"]
+        self._output_index = self._interpreter.get_output_details()[0]["index"]
+        self._size_of_input = size_of_input
+        self._embedding_dim = embedding_dim
+        self._batch = None
+        self._lock = threading.Lock()
+
+    def __call__(self, input_x, batch_size=None):
+        return _in_chunks(self._run, input_x, batch_size)
+
+    def _run(self, input_x):
+        input_x = np.ascontiguousarray(input_x, dtype=np.float32)
+        with self._lock:
+            # Only re-allocate the tensors when the batch dimension changes
+            if self._batch != input_x.shape[0]:
+                self._interpreter.resize_tensor_input(self._input_index,
+                                                      [input_x.shape[0], self._size_of_input, self._embedding_dim])
+                self._interpreter.allocate_tensors()
+                self._batch = input_x.shape[0]
+            self._interpreter.set_tensor(self._input_index, input_x)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output_index).copy()
+
+
+def create_runtime(name, model, size_of_input, embedding_dim, jit_compile=False):
+    """Create the inference runtime selected by the "runtime" model parameter"""
+    if name == "predict":
+        return PredictRuntime(model)
+    if name == "function":
+        return FunctionRuntime(model, size_of_input, embedding_dim, jit_compile)
+    if name == "tflite":
+        return TFLiteRuntime(model, size_of_input, embedding_dim)
+    raise ValueError(f"Unknown runtime: {name}, expected one of {', '.join(RUNTIMES)}")
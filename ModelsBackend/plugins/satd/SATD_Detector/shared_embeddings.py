@@ -0,0 +1,192 @@
+"""
+Memory-mapped fastText word embeddings, shared read-only across worker processes
+
+The fastText ``.bin`` model is exported once into a directory of ``.npy`` files: the input matrix (word and subword
+bucket vectors), an open-addressing vocabulary index and the vocabulary itself as one UTF-8 blob. Every worker maps
+these files instead of loading the full model, so the pages are shared through the OS page cache and memory does not
+grow with the number of workers. Word vectors are computed exactly like fastText's ``get_word_vector``: the average of
+the word's own row (for in-vocabulary words) and the rows of its character n-grams.
+"""
+
+import fcntl
+import json
+import os
+
+import numpy as np
+
+BOW = "<"
+EOW = ">"
+EOS = "</s>"
+FORMAT_VERSION = 1
+
+
+def fasttext_hash(data):
+    """FNV-1a variant used by fastText (bytes are sign-extended before the xor)"""
+    h = 2166136261
+    for byte in data:
+        h ^= byte | 0xFFFFFF00 if byte & 0x80 else byte
+        h = (h * 16777619) & 0xFFFFFFFF
+    return h
+
+
+def _subword_hashes(word, minn, maxn):
+    """Hashes of the character n-grams of ``word`` (already wrapped in BOW/EOW), as fastText's computeSubwords"""
+    data = word.encode("utf-8")
+    hashes = []
+    for i in range(len(data)):
+        if data[i] & 0xC0 == 0x80:
+            continue
+        j = i
+        n = 1
+        while j < len(data) and n <= maxn:
+            j += 1
+            while j < len(data) and data[j] & 0xC0 == 0x80:
+                j += 1
+            if n >= minn and not (n == 1 and (i == 0 or j == len(data))):
+                hashes.append(fasttext_hash(data[i:j]))
+            n += 1
+    return hashes
+
+
+def _index_size(nwords):
+    size = 1
+    while size < 2 * nwords:
+        size *= 2
+    return size
+
+
+def source_fingerprint(word_embedding_file):
+    """Identifies the ``.bin`` model an export was made from, so that replacing the model invalidates the export"""
+    stat = os.stat(word_embedding_file)
+    return {"source": os.path.abspath(word_embedding_file), "source_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns}
+
+
+def export(word_embedding_file, directory):
+    """Export a fastText ``.bin`` model into ``directory``"""
+    import fasttext
+
+    fingerprint = source_fingerprint(word_embedding_file)
+    model = fasttext.load_model(word_embedding_file)
+    args = model.f.getArgs()
+    write(directory, model.get_words(include_freq=False), model.get_input_matrix(), args.minn, args.maxn, args.bucket,
+          fingerprint)
+
+
+def _save(directory, name, array):
+    # Replaced at once, so processes still mapping a previous export keep reading its (unlinked) file
+    temporary_path = os.path.join(directory, name + ".tmp.npy")
+    np.save(temporary_path, array)
+    os.replace(temporary_path, os.path.join(directory, name + ".npy"))
+
+
+def write(directory, words, input_matrix, minn, maxn, bucket, fingerprint=None):
+    """Write an export from a vocabulary (in word id order) and an input matrix of len(words) + bucket rows"""
+    os.makedirs(directory, exist_ok=True)
+    # A previous export stays invalid until this one is complete
+    meta_path = os.path.join(directory, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    encoded = [word.encode("utf-8") for word in words]
+
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(word) for word in encoded])
+    index = np.full(_index_size(len(encoded)), -1, dtype=np.int32)
+    mask = len(index) - 1
+    for word_id, word in enumerate(encoded):
+        slot = fasttext_hash(word) & mask
+        while index[slot] != -1:
+            slot = (slot + 1) & mask
+        index[slot] = word_id
+
+    _save(directory, "input_matrix", np.asarray(input_matrix, dtype=np.float32))
+    _save(directory, "vocabulary", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    _save(directory, "offsets", offsets)
+    _save(directory, "index", index)
+    # Written last: its presence marks a complete export
+    with open(meta_path, "w") as f:
+        json.dump({"format": FORMAT_VERSION, **(fingerprint or {}), "nwords": len(words),
+                   "dim": int(np.shape(input_matrix)[1]), "minn": minn, "maxn": maxn, "bucket": bucket}, f)
+
+
+def is_current(word_embedding_file, directory):
+    """Whether ``directory`` holds a complete export of the current version of the model"""
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if not os.path.exists(word_embedding_file):
+        # Nothing to compare with (e.g. only the export is deployed), the export is used as is
+        return meta.get("format") == FORMAT_VERSION
+    expected = {"format": FORMAT_VERSION, **source_fingerprint(word_embedding_file)}
+    return all(meta.get(key) == value for key, value in expected.items())
+
+
+def ensure_exported(word_embedding_file, directory):
+    """
+    Export the model unless an export of the same model file (path, size and modification time) exists; concurrent
+    workers wait for the one holding the lock
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not is_current(word_embedding_file, directory):
+                print('Exporting word embeddings {} to {}...'.format(word_embedding_file, directory), flush=True)
+                export(word_embedding_file, directory)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class SharedEmbeddings:
+    """Drop-in replacement for the fastText model's ``model[word]`` and ``get_dimension()``"""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self._nwords = meta["nwords"]
+        self._dim = meta["dim"]
+        self._minn = meta["minn"]
+        self._maxn = meta["maxn"]
+        self._bucket = meta["bucket"]
+        self._matrix = np.load(os.path.join(directory, "input_matrix.npy"), mmap_mode="r")
+        self._vocabulary = np.load(os.path.join(directory, "vocabulary.npy"), mmap_mode="r")
+        self._offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self._index = np.load(os.path.join(directory, "index.npy"), mmap_mode="r")
+        self._mask = len(self._index) - 1
+
+    def get_dimension(self):
+        return self._dim
+
+    def get_word_id(self, word):
+        data = word.encode("utf-8")
+        slot = fasttext_hash(data) & self._mask
+        while True:
+            word_id = int(self._index[slot])
+            if word_id == -1:
+                return -1
+            if self._vocabulary[self._offsets[word_id]:self._offsets[word_id + 1]].tobytes() == data:
+                return word_id
+            slot = (slot + 1) & self._mask
+
+    def get_subwords(self, word):
+        """Rows of the input matrix averaged into the vector of ``word``"""
+        rows = []
+        word_id = self.get_word_id(word)
+        if word_id >= 0:
+            rows.append(word_id)
+        if word != EOS:
+            rows.extend(self._nwords + h % self._bucket for h in _subword_hashes(BOW + word + EOW, self._minn,
+                                                                                  self._maxn))
+        return rows
+
+    def __getitem__(self, word):
+        # Accumulated in float32 and in the same order as fastText, so the vectors are bit-identical
+        vector = np.zeros(self._dim, dtype=np.float32)
+        rows = self.get_subwords(word)
+        for row in rows:
+            vector += self._matrix[row]
+        if rows:
+            vector *= np.float32(1.0 / len(rows))
+        return vector
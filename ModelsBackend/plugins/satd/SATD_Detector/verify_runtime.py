@@ -0,0 +1,79 @@
+"""
+Check that an inference runtime produces the same labels as the reference keras ``predict`` path on the SATD datasets
+
+Run from the ModelsBackend directory:
+    python -m plugins.satd.SATD_Detector.verify_runtime --runtime tflite
+"""
+
+import argparse
+import csv
+import sys
+
+import numpy as np
+
+from plugins.satd.SATD_Detector.model import Model1_IssueTracker_Li2022_ESEM
+
+DATASETS = [
+    "plugins/satd/satd-dataset-commit_messages.csv",
+    "plugins/satd/satd-dataset-pull_requests.csv",
+]
+
+
+def read_texts(datasets, limit=None):
+    """Stream the "text" column of the SATD CSV files"""
+    count = 0
+    for dataset in datasets:
+        with open(dataset, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if limit is not None and count >= limit:
+                    return
+                count += 1
+                yield row["text"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runtime", required=True, choices=["function", "tflite"])
+    parser.add_argument("--weight-file", default="plugins/satd/SATD_Detector/data/weights.hdf5")
+    parser.add_argument("--word-embedding-file", default="plugins/satd/SATD_Detector/data/embeddings.bin")
+    parser.add_argument("--dataset", action="append", help="CSV file with a 'text' column (default: bundled SATD CSVs)")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--limit", type=int, help="Only check the first N texts")
+    args = parser.parse_args()
+
+    model = Model1_IssueTracker_Li2022_ESEM(args.weight_file, args.word_embedding_file, runtime=args.runtime)
+    reference = model.build_runtime("predict")
+    candidate = model.build_runtime(args.runtime)
+
+    checked = 0
+    mismatches = 0
+    max_abs_diff = 0.0
+    batch = []
+
+    def compare(texts):
+        nonlocal checked, mismatches, max_abs_diff
+        input_x = np.concatenate([model.prepare_comments(text) for text in texts])
+        y_reference = reference(input_x, batch_size=args.batch_size)
+        y_candidate = candidate(input_x, batch_size=args.batch_size)
+        different = np.argmax(y_reference, axis=1) != np.argmax(y_candidate, axis=1)
+        for text in np.asarray(texts, dtype=object)[different]:
+            print(f"Label mismatch: {text[:80]!r}", flush=True)
+        checked += len(texts)
+        mismatches += int(different.sum())
+        max_abs_diff = max(max_abs_diff, float(np.max(np.abs(y_reference - y_candidate))))
+
+    for text in read_texts(args.dataset or DATASETS, args.limit):
+        batch.append(text)
+        if len(batch) == args.batch_size:
+            compare(batch)
+            batch = []
+    if batch:
+        compare(batch)
+
+    print(f"Checked {checked} texts with the {args.runtime} runtime: {mismatches} label mismatch(es), "
+          f"max absolute probability difference {max_abs_diff:.2e}", flush=True)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
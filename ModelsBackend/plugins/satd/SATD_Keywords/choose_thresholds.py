@@ -0,0 +1,57 @@
+"""
+Report, for candidate thresholds of SATD_Keyword_Cascade, how many texts of the labeled SATD datasets the keyword stage
+would label without the wrapped model, and how many of them it would get wrong
+
+Run from the ModelsBackend directory:
+    python -m plugins.satd.SATD_Keywords.choose_thresholds --clean 0 0.005 0.01 0.02 --satd 0.2 0.3
+"""
+
+import argparse
+import csv
+
+from plugins.satd.SATD_Keywords.model import DEFAULT_KEYWORD_FILE, SATD_Keywords
+
+DATASETS = [
+    "plugins/satd/satd-dataset-commit_messages.csv",
+    "plugins/satd/satd-dataset-pull_requests.csv",
+]
+
+
+def read_scores(keywords, dataset, limit=None):
+    """Keyword score and SATD flag of every labeled text of a SATD CSV file"""
+    scores = []
+    with open(dataset, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if limit is not None and len(scores) >= limit:
+                break
+            scores.append((keywords.score(row["text"]), row["classification"] != "non_debt"))
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--keyword-file", default=DEFAULT_KEYWORD_FILE)
+    parser.add_argument("--dataset", action="append", help="SATD CSV file (default: bundled SATD CSVs)")
+    parser.add_argument("--clean", type=float, nargs="+", default=[0.0, 0.005, 0.01, 0.02, 0.03])
+    parser.add_argument("--satd", type=float, nargs="+", default=[0.2, 0.3, 0.5])
+    parser.add_argument("--limit", type=int, help="Only score the first N texts of each dataset")
+    args = parser.parse_args()
+
+    keywords = SATD_Keywords(args.keyword_file)
+    for dataset in args.dataset or DATASETS:
+        scores = read_scores(keywords, dataset, args.limit)
+        satd = sum(is_satd for _, is_satd in scores)
+        print(f"{dataset}: {len(scores)} texts, {satd} SATD")
+        for threshold in args.clean:
+            skipped = [is_satd for score, is_satd in scores if score <= threshold]
+            print(f"  clean_threshold {threshold}: {len(skipped) / len(scores):.1%} of the texts labeled non-SATD, "
+                  f"{sum(skipped) / max(satd, 1):.1%} of the SATD texts lost")
+        for threshold in args.satd:
+            labeled = [is_satd for score, is_satd in scores if score >= threshold]
+            precision = f"{sum(labeled) / len(labeled):.1%}" if labeled else "n/a"
+            print(f"  satd_threshold {threshold}: {len(labeled) / len(scores):.1%} of the texts labeled SATD, "
+                  f"{precision} of them SATD")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import ast
+import re
+import threading
+import time
+from collections import deque
+
+import nltk
+from model import factory
+from model.batching import label_batch
+
+DEFAULT_KEYWORD_FILE = "plugins/satd/SATD Keyowrds/SATD Keywords for different sources/Keywords for issues.txt"
+
+_keyword_line = re.compile(r'^\s*([0-9.eE+-]+)\s*->\s*(\(.*\))\s*$')
+
+
+def load_keywords(keyword_file):
+    """
+    Read a weighted SATD keyword list, e.g. "0.738791 -> ('flaky', 'test')"
+
+    :param keyword_file:
+    :return: list of (token tuple, weight)
+    """
+    keywords = []
+    with open(keyword_file, encoding='utf-8') as f:
+        for line in f:
+            match = _keyword_line.match(line)
+            if match is None:
+                continue
+            tokens = ast.literal_eval(match.group(2))
+            # The lists contain an empty tuple, which cannot be matched
+            if tokens:
+                keywords.append((tuple(tokens), float(match.group(1))))
+    return keywords
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over token sequences: every keyword occurrence in a token list is found in one linear pass
+    """
+
+    def __init__(self, keywords):
+        self._weights = [weight for _, weight in keywords]
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for keyword_id, (tokens, _) in enumerate(keywords):
+            node = 0
+            for token in tokens:
+                if token not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[node][token] = len(self._goto) - 1
+                node = self._goto[node][token]
+            self._output[node].append(keyword_id)
+
+        # Breadth-first construction of the failure links, merging the outputs of each node's longest proper suffix
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(token, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def matches(self, tokens):
+        """Ids of the distinct keywords occurring in the token list"""
+        found = set()
+        node = 0
+        for token in tokens:
+            while node and token not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token, 0)
+            found.update(self._output[node])
+        return found
+
+    def score(self, tokens):
+        """Sum of the weights of the distinct keywords occurring in the token list"""
+        return sum(self._weights[keyword_id] for keyword_id in self.matches(tokens))
+
+
+class SATD_Keywords:
+    """
+    Self-admitted technical debt classifier based on the weighted keyword lists of the SATD replication package
+    """
+
+    name:str
+
+    def __init__(self, keyword_file=DEFAULT_KEYWORD_FILE, satd_threshold=0.1):
+        print('Loading keywords {}...'.format(keyword_file))
+        self._matcher = KeywordMatcher(load_keywords(keyword_file))
+        self._satd_threshold = satd_threshold
+        self._tokenizer_words = nltk.TweetTokenizer()
+        self._labels = ['SATD', 'non-SATD']
+        # Optional callable(stage, seconds) notified after the "keywords" stage
+        self.stage_observer = None
+
+    def score(self, comment):
+        """
+        Keyword score of a comment, tokenized like the keyword lists (lowercased tweet tokens)
+
+        :param comment:
+        :return:
+        """
+        start = time.perf_counter()
+        comment = re.sub('(//)|(/\\*)|(\\*/)', '', comment).lower()
+        score = self._matcher.score(self._tokenizer_words.tokenize(comment))
+        if self.stage_observer is not None:
+            self.stage_observer('keywords', time.perf_counter() - start)
+        return score
+
+    def label(self, comment):
+        return self._labels[0] if self.score(comment) >= self._satd_threshold else self._labels[1]
+
+    def label_batch(self, comments, batch_size):
+        return [self.label(comment) for comment in comments]
+
+
+class SATD_Keyword_Cascade(SATD_Keywords):
+    """
+    Keyword stage in front of another model: texts scoring at least ``satd_threshold`` are labeled SATD and texts
+    scoring at most ``clean_threshold`` non-SATD right away, only the texts in between are sent to the wrapped model.
+
+    The wrapped model is the name of another entry of the "models" list of config.json, whose instance (and weights) is
+    shared through the model registry, or a full model description like those entries, which creates a private copy.
+
+    With the keywords for issues, ``clean_threshold`` 0.01 skips the wrapped model for 37% of the bundled pull request
+    texts (54% of the commit messages) and labels 3.3% (17.9%) of their SATD texts non-SATD, see choose_thresholds.py.
+    Higher thresholds skip more texts but quickly lose more SATD (10.6% of the pull request SATD at 0.02).
+    """
+
+    def __init__(self, model, keyword_file=DEFAULT_KEYWORD_FILE, satd_threshold=0.3, clean_threshold=0.01):
+        self._owns_model = not isinstance(model, str)
+        self._model = factory.create_model(model) if self._owns_model else factory.get_model(model)
+        super().__init__(keyword_file, satd_threshold)
+        self._clean_threshold = clean_threshold
+        # A shared model was loaded (and timed) by its own registry entry
+        self.load_timings = getattr(self._model, 'load_timings', {}) if self._owns_model else {}
+        self._lock = threading.Lock()
+        self._counts = {'keyword_satd': 0, 'keyword_clean': 0, 'model': 0}
+
+    @property
+    def stage_observer(self):
+        return self._stage_observer
+
+    @stage_observer.setter
+    def stage_observer(self, observer):
+        # A private wrapped model reports its own stages to the same observer, a shared one keeps reporting them under
+        # its own name
+        self._stage_observer = observer
+        if self._owns_model and hasattr(self._model, 'stage_observer'):
+            self._model.stage_observer = observer
+
+    def _keyword_label(self, comment):
+        score = self.score(comment)
+        if score >= self._satd_threshold:
+            return self._labels[0], 'keyword_satd'
+        if score <= self._clean_threshold:
+            return self._labels[1], 'keyword_clean'
+        return None, 'model'
+
+    def label(self, comment):
+        label, stage = self._keyword_label(comment)
+        with self._lock:
+            self._counts[stage] += 1
+        return label if label is not None else self._model.label(comment)
+
+    def label_batch(self, comments, batch_size):
+        labels = []
+        ambiguous = []
+        for index, comment in enumerate(comments):
+            label, stage = self._keyword_label(comment)
+            with self._lock:
+                self._counts[stage] += 1
+            labels.append(label)
+            if label is None:
+                ambiguous.append(index)
+        if ambiguous:
+            model_labels = label_batch(self._model, [comments[index] for index in ambiguous], batch_size)
+            for index, label in zip(ambiguous, model_labels):
+                labels[index] = label
+        return labels
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        stats = {'cascade': {**counts, 'skipped_fraction': (total - counts['model']) / total if total else 0.0}}
+        if hasattr(self._model, 'stats'):
+            stats.update(self._model.stats())
+        return stats
+
+
+def initialize() -> None:
+    factory.register_model("SATD_Keywords", SATD_Keywords)
+    factory.register_model("SATD_Keyword_Cascade", SATD_Keyword_Cascade)